@@ -1,15 +1,16 @@
 # -*- coding: utf-8 -*-
 # zato: ide-deploy=True
 
-import json
-from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister
-
 # Zato
 from zato.server.service import IBMQuantumService
 
+from ibm_batch import BatchedExecutionMixin
+from qrng_health import health_monitor
+from service_metrics import TimedServiceMixin
+
 # ##############################################################################
 
-class QuantumRandomNumberGeneratosService(IBMQuantumService):
+class QuantumRandomNumberGeneratosService(TimedServiceMixin, IBMQuantumService):
     """ Generates quantum random numbers
     """
     name = 'quantum.qrng'
@@ -17,6 +18,7 @@ class QuantumRandomNumberGeneratosService(IBMQuantumService):
     key_name = 'ibm_quantum'
 
     def circuit(self):
+        from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister
 
         qreg_q = QuantumRegister(1, 'q')
         creg_c = ClassicalRegister(1, 'c')
@@ -31,7 +33,15 @@ class QuantumRandomNumberGeneratosService(IBMQuantumService):
     def after_circuit_execution(self):
         bitstring = ''.join(self.circuit_result.get_memory())
         result = int(bitstring, base=2)
-        self.logger.info(result)
-        self.logger.info("Bitstring: %s. Bytes: %b ", bitstring, result)
+        # The bits are key material of quantum.quantum-aes, only their count is logged
+        self.logger.info('QRNG: %d random bits', len(bitstring))
+        # Health tests run in the background on the pooled output of every request
+        health_monitor.submit(bitstring)
 
         self.response.payload = {"bitstring": bitstring, "integer": result}
+
+
+class BatchedQuantumRandomNumberGeneratorService(BatchedExecutionMixin, QuantumRandomNumberGeneratosService):
+    """ Generates quantum random numbers, coalescing concurrent requests into multi-circuit jobs
+    """
+    name = 'quantum.qrng-batched'
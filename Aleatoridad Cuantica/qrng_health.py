@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+# zato: ide-deploy=True
+
+import math
+import queue
+import time
+from threading import Lock, Thread
+from typing import Dict, Optional, Union
+
+import numpy as np
+
+# Zato
+from zato.server.service import Service
+
+from service_metrics import metrics
+
+# Assessed min-entropy per bit of the source and false positive probability of the
+# SP 800-90B continuous health tests
+MIN_ENTROPY = 1.0
+ALPHA = 2.0**-20
+# Window of the Adaptive Proportion Test for binary sources
+APT_WINDOW = 1024
+# Block of the monobit test and its bounds on the number of ones (FIPS 140-2)
+MONOBIT_BLOCK = 20000
+MONOBIT_BOUNDS = (9725, 10275)
+
+# ##############################################################################
+
+def rct_cutoff(min_entropy: float = MIN_ENTROPY, alpha: float = ALPHA) -> int:
+    """Repetition Count Test cutoff, 1 + ceil(-log2(alpha) / H).
+    Args:
+        min_entropy (float): Min-entropy per sample H
+        alpha (float): False positive probability
+    Returns:
+        int: Run length that fails the test
+    """
+    return 1 + math.ceil(-math.log2(alpha) / min_entropy)
+
+
+def apt_cutoff(window: int = APT_WINDOW, min_entropy: float = MIN_ENTROPY, alpha: float = ALPHA) -> int:
+    """Adaptive Proportion Test cutoff, 1 + CRITBINOM(W, 2^-H, 1 - alpha), computed with the
+    log-gamma binomial probabilities.
+    Args:
+        window (int): Window size W
+        min_entropy (float): Min-entropy per sample H
+        alpha (float): False positive probability
+    Returns:
+        int: Occurrences of the first sample of a window that fail the test
+    """
+    p = 2.0**-min_entropy
+    log_n = math.lgamma(window + 1)
+    cumulative = 0.0
+    for k in range(window + 1):
+        cumulative += math.exp(
+            log_n - math.lgamma(k + 1) - math.lgamma(window - k + 1)
+            + (k * math.log(p) if k else 0.0) + ((window - k) * math.log1p(-p) if k < window else 0.0)
+        )
+        if cumulative >= 1 - alpha:
+            return 1 + k
+    return window
+
+
+def to_bits(sample: Union[str, bytes, np.ndarray]) -> np.ndarray:
+    """Bits of a QRNG sample as a uint8 array of 0 and 1.
+    Args:
+        sample (Union[str, bytes, ndarray]): Bitstring of '0' and '1', packed bytes or array of bits
+    Returns:
+        ndarray: Bits
+    """
+    if isinstance(sample, str):
+        return np.frombuffer(sample.encode('ascii'), dtype=np.uint8) - ord('0')
+    if isinstance(sample, (bytes, bytearray)):
+        return np.unpackbits(np.frombuffer(sample, dtype=np.uint8))
+    return np.asarray(sample, dtype=np.uint8)
+
+
+class RepetitionCountTest:
+    """ SP 800-90B Repetition Count Test over a stream of bit blocks. The current run is carried
+    between blocks, and every run reaching the cutoff counts as one failure.
+    """
+    def __init__(self, cutoff: Optional[int] = None):
+        self.cutoff = cutoff or rct_cutoff()
+        self.last = None
+        self.run = 0
+
+    def update(self, bits: np.ndarray) -> int:
+        """Test a block.
+        Args:
+            bits (ndarray): Bits of the block
+        Returns:
+            int: Failures in the block
+        """
+        if not len(bits):
+            return 0
+        starts = np.concatenate(([0], np.flatnonzero(bits[1:] != bits[:-1]) + 1))
+        lengths = np.diff(np.append(starts, len(bits)))
+        before = np.zeros_like(lengths)
+        if bits[0] == self.last:
+            before[0] = self.run
+            lengths[0] += self.run
+        self.last = int(bits[-1])
+        self.run = int(lengths[-1])
+        # A run spanning blocks fails once, in the block where it reaches the cutoff
+        return int(np.count_nonzero((lengths >= self.cutoff) & (before < self.cutoff)))
+
+
+class AdaptiveProportionTest:
+    """ SP 800-90B Adaptive Proportion Test over a stream of bit blocks, on consecutive windows
+    of APT_WINDOW bits. At most one incomplete window is carried between blocks.
+    """
+    def __init__(self, window: int = APT_WINDOW, cutoff: Optional[int] = None):
+        self.window = window
+        self.cutoff = cutoff or apt_cutoff(window)
+        self.pending = np.empty(0, dtype=np.uint8)
+
+    def update(self, bits: np.ndarray) -> Dict[str, int]:
+        """Test a block.
+        Args:
+            bits (ndarray): Bits of the block
+        Returns:
+            Dict[str, int]: Completed windows and failures in the block
+        """
+        bits = np.concatenate((self.pending, bits))
+        n_windows = len(bits) // self.window
+        self.pending = bits[n_windows * self.window:].copy()
+        windows = bits[:n_windows * self.window].reshape(n_windows, self.window)
+        counts = np.count_nonzero(windows == windows[:, :1], axis=1)
+        return {"windows": n_windows, "failures": int(np.count_nonzero(counts >= self.cutoff))}
+
+
+class MonobitTest:
+    """ Monobit test on consecutive blocks of MONOBIT_BLOCK bits. At most one incomplete block is
+    carried between updates.
+    """
+    def __init__(self, block: int = MONOBIT_BLOCK, bounds: tuple = MONOBIT_BOUNDS):
+        self.block = block
+        # The FIPS 140-2 bounds are for 20000-bit blocks, other sizes scale them
+        scale = block / MONOBIT_BLOCK
+        self.low, self.high = bounds[0] * scale, bounds[1] * scale
+        self.pending = np.empty(0, dtype=np.uint8)
+
+    def update(self, bits: np.ndarray) -> Dict[str, int]:
+        """Test a block.
+        Args:
+            bits (ndarray): Bits of the block
+        Returns:
+            Dict[str, int]: Completed monobit blocks and failures
+        """
+        bits = np.concatenate((self.pending, bits))
+        n_blocks = len(bits) // self.block
+        self.pending = bits[n_blocks * self.block:].copy()
+        ones = bits[:n_blocks * self.block].reshape(n_blocks, self.block).sum(axis=1)
+        return {"blocks": n_blocks, "failures": int(np.count_nonzero((ones <= self.low) | (ones >= self.high)))}
+
+# ##############################################################################
+
+class HealthMonitor:
+    """ Runs the health tests on the pooled output of the QRNG services in a background thread.
+
+    submit never blocks the caller: samples are queued and dropped, and counted as dropped,
+    when the queue is full. ALPHA is the false positive probability per sample, so a healthy
+    source still fails the Repetition Count Test about once every 2^20 bits.
+    """
+    def __init__(self, max_pending: int = 1024):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = Lock()
+        self._worker = None
+        self.rct = RepetitionCountTest()
+        self.apt = AdaptiveProportionTest()
+        self.monobit = MonobitTest()
+        self.counters = {
+            "bits": 0,
+            "dropped_samples": 0,
+            "rct_failures": 0,
+            "apt_windows": 0,
+            "apt_failures": 0,
+            "monobit_blocks": 0,
+            "monobit_failures": 0,
+        }
+        self.last_failure = None
+
+    def submit(self, sample: Union[str, bytes, np.ndarray]) -> None:
+        """Queue a sample for testing.
+        Args:
+            sample (Union[str, bytes, ndarray]): QRNG output, see to_bits
+        """
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(sample)
+        except queue.Full:
+            with self._lock:
+                self.counters["dropped_samples"] += 1
+
+    def _ensure_worker(self) -> None:
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = Thread(target=self._run, name='qrng-health', daemon=True)
+                self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            self.process(to_bits(self._queue.get()))
+
+    def process(self, bits: np.ndarray) -> None:
+        """Run every test on a block of bits and update the counters.
+        Args:
+            bits (ndarray): Bits of the block
+        """
+        rct_failures = self.rct.update(bits)
+        apt = self.apt.update(bits)
+        monobit = self.monobit.update(bits)
+        failures = {"rct": rct_failures, "apt": apt["failures"], "monobit": monobit["failures"]}
+
+        with self._lock:
+            self.counters["bits"] += len(bits)
+            self.counters["rct_failures"] += rct_failures
+            self.counters["apt_windows"] += apt["windows"]
+            self.counters["apt_failures"] += apt["failures"]
+            self.counters["monobit_blocks"] += monobit["blocks"]
+            self.counters["monobit_failures"] += monobit["failures"]
+            if any(failures.values()):
+                self.last_failure = time.time()
+
+        metrics.increment('qrng_health_bits_total', {}, len(bits))
+        for test, count in failures.items():
+            if count:
+                metrics.increment('qrng_health_failures_total', {'test': test}, count)
+
+    def snapshot(self) -> Dict:
+        """Counters of the tests, time of the last failure and samples waiting to be tested.
+        """
+        with self._lock:
+            counters = dict(self.counters)
+            last_failure = self.last_failure
+        counters["last_failure"] = last_failure
+        counters["pending_samples"] = self._queue.qsize()
+        return counters
+
+
+health_monitor = HealthMonitor()
+
+
+class QrngHealth(Service):
+    """ Returns the counters of the QRNG health tests.
+    """
+    name = 'quantum.qrng-health'
+
+    def handle(self):
+        self.response.payload = health_monitor.snapshot()
@@ -1,17 +1,58 @@
 # -*- coding: utf-8 -*-
 # zato: ide-deploy=True
 
+import ast
 import math
 import json
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from threading import Lock
+from typing import Any, Dict, List, Optional, Set
 import numpy as np
 from braket.circuits import Circuit, circuit
 from braket.circuits.qubit_set import QubitSetInput
-from braket.devices import Device
 
-from zato.server.service import AWSQuantumService
+from zato.server.service import AWSQuantumService, Service
 
+from circuit_library import qft_circuit
+from device_routing import DeviceRoutingMixin
+from result_cache import ResultCacheMixin
+from service_metrics import TimedServiceMixin
 
-class ShorAlgorithm(AWSQuantumService):
+# Batches of quantum.shor-algorithm-batch that already factored N, the most recent last. Their
+# runs that have not built their circuit yet are abandoned instead of submitting a task
+CANCELLED_BATCHES_SIZE = 256
+_cancelled_batches = OrderedDict()
+_cancelled_batches_lock = Lock()
+
+
+class BatchCancelled(Exception):
+    """ Raised by a run of a batch that has already factored N.
+    """
+
+
+def cancel_batch(batch_id: str) -> None:
+    with _cancelled_batches_lock:
+        _cancelled_batches[batch_id] = True
+        while len(_cancelled_batches) > CANCELLED_BATCHES_SIZE:
+            _cancelled_batches.popitem(last=False)
+
+
+def check_batch(payload: Dict[str, Any]) -> None:
+    """
+    Raise BatchCancelled when the run belongs to a batch that has already factored N
+
+    Args:
+        payload (Dict[str, Any]): Request payload, with the 'batch' id set by quantum.shor-algorithm-batch
+    """
+    with _cancelled_batches_lock:
+        cancelled = payload.get('batch') in _cancelled_batches
+    if cancelled:
+        raise BatchCancelled(f'Batch {payload["batch"]} already factored N')
+
+
+class ShorAlgorithm(TimedServiceMixin, DeviceRoutingMixin, ResultCacheMixin, AWSQuantumService):
 
     name = 'quantum.shor-algorithm'
     runs = 100
@@ -19,6 +60,8 @@ class ShorAlgorithm(AWSQuantumService):
     key_name = 'key'
 
     def circuit(self):
+        # Built before the task is submitted, so a cancelled batch submits nothing more
+        check_batch(self.request.payload)
         return shors_algorithm(self.request.payload['N'], self.request.payload['a'])
     
     def after_circuit_execution(self):
@@ -27,46 +70,177 @@ class ShorAlgorithm(AWSQuantumService):
             "N": self.request.payload['N'],
             "a": self.request.payload['a']
         }
-        self.logger.info(json.dumps(out))
+        self.logger.info('Shor N=%s a=%s: %d distinct outcomes', out['N'], out['a'], len(out['measurement_counts']))
         response = self.invoke('shor.shor-post-procesing', json.dumps(out))
         self.response.payload = response
 
-@circuit.subroutine(register=True)
-def inverse_qft_noswaps(qubits: QubitSetInput) -> Circuit:
+class ShorAlgorithmSemiclassical(Service):
+    """ Shor's algorithm with a single recycled control qubit (semiclassical QFT)
     """
-    Construct a circuit object corresponding to the inverse Quantum Fourier Transform (QFT)
-    algorithm, applied to the argument qubits.  Does not use recursion to generate the circuit.
+    name = 'quantum.shor-algorithm-semiclassical'
+    runs = 100
+
+    def handle(self):
+        check_batch(self.request.payload)
+        integer_N = int(self.request.payload['N'])
+        integer_a = int(self.request.payload['a'])
+        shots = int(self.request.payload.get('runs', self.runs))
+
+        measurement_counts = semiclassical_shors_algorithm(integer_N, integer_a, shots)
+        out = {
+            "measurement_counts": dict(measurement_counts),
+            "N": integer_N,
+            "a": integer_a
+        }
+        self.logger.info('Shor N=%s a=%s: %d distinct outcomes', integer_N, integer_a, len(measurement_counts))
+        response = self.invoke('shor.shor-post-procesing', json.dumps(out))
+        self.response.payload = response
+
+class ShorAlgorithmBatch(Service):
+    """ Runs Shor's algorithm for several candidate bases concurrently and returns
+    the first verified factorization of N
+
+    Once N is factored, the runs that have not started are dropped and the running ones stop
+    before submitting their task (see check_batch). Tasks already submitted by the invoked
+    service finish on the device, their results are ignored.
+    """
+    name = 'quantum.shor-algorithm-batch'
+    max_workers = 4
+
+    def handle(self):
+        integer_N = int(self.request.payload['N'])
+        bases = [int(a) for a in self.request.payload['bases']]
+        if self.request.payload.get('semiclassical'):
+            service_name = 'quantum.shor-algorithm-semiclassical'
+        else:
+            service_name = 'quantum.shor-algorithm'
+
+        output = {
+            "N": integer_N,
+            "a": None,
+            "factors": None,
+            "results": {},
+        }
+
+        # A base sharing a factor with N already factors it, no circuit needed
+        for integer_a in bases:
+            divisor = math.gcd(integer_a, integer_N)
+            if 1 < divisor < integer_N:
+                output["a"] = integer_a
+                output["factors"] = sorted([divisor, integer_N // divisor])
+                self.response.payload = output
+                return
+
+        run = partial(self.run_base, service_name, integer_N)
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        futures = {executor.submit(run, integer_a): integer_a for integer_a in bases}
+        try:
+            for future in as_completed(futures):
+                integer_a = futures[future]
+                try:
+                    guessed_factors = parse_guessed_factors(future.result())
+                except Exception as e:
+                    self.logger.warning('Shor run failed for a=%s: %s', integer_a, e)
+                    output["results"][str(integer_a)] = {"error": str(e)}
+                    continue
+
+                output["results"][str(integer_a)] = {"guessed_factors": sorted(guessed_factors)}
+                factors = verified_factorization(integer_N, guessed_factors)
+                if factors:
+                    output["a"] = integer_a
+                    output["factors"] = factors
+                    break
+        finally:
+            # Runs that have not started yet are dropped and the running ones abandoned once N is factored
+            cancel_batch(self.cid)
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        self.response.payload = output
+
+    def run_base(self, service_name: str, integer_N: int, integer_a: int) -> Any:
+        """Run Shor's algorithm for one base through service_name.
+        Args:
+            service_name (str): quantum.shor-algorithm or quantum.shor-algorithm-semiclassical
+            integer_N (int): The integer N to be factored
+            integer_a (int): Base of the run
+        Returns:
+            Any: Response of shor.shor-post-procesing
+        """
+        return self.invoke(service_name, {'N': integer_N, 'a': integer_a, 'batch': self.cid})
+
+# Controlled-swap sequence (indices into the auxiliary register) implementing one
+# multiplication by a mod 15, and the values of a that also need every aux qubit flipped
+AMOD15_SWAPS = {
+    2: [(0, 1), (1, 2), (2, 3)],
+    13: [(0, 1), (1, 2), (2, 3)],
+    7: [(2, 3), (1, 2), (0, 1)],
+    8: [(2, 3), (1, 2), (0, 1)],
+    11: [(1, 3), (0, 2)],
+}
+AMOD15_FLIPS = [7, 11, 13]
+
+
+def parse_guessed_factors(response: Any) -> Set[int]:
+    """
+    Extract the guessed factors from a shor.shor-post-procesing response
 
     Args:
-        qubits (QubitSetInput): Qubits on which to apply the inverse Quantum Fourier Transform
+        response (Any): Response payload, the str() of the post-processing result dict
 
     Returns:
-        Circuit: Circuit object that implements the inverse Quantum Fourier Transform algorithm
+        Set[int]: Non-trivial factors guessed for N
     """
-    # Instantiate circuit object
-    qft_circuit = Circuit()
+    if isinstance(response, dict):
+        return set(response["guessed_factors"])
+    # An empty set is printed as set(), which is not a literal
+    results: Dict[str, Any] = ast.literal_eval(response.replace("set()", "[]"))
+    return set(results["guessed_factors"])
 
-    # Fet number of qubits
-    num_qubits = len(qubits)
 
-    # First add SWAP gates to reverse the order of the qubits:
-    # for i in range(math.floor(num_qubits / 2)):
-    #     qft_circuit.swap(qubits[i], qubits[-i - 1])
+def verified_factorization(integer_N: int, guessed_factors: Set[int]) -> Optional[List[int]]:
+    """
+    Check the guessed factors against N
 
-    # Start on the last qubit and work to the first.
-    for k in reversed(range(num_qubits)):
-        # Apply the controlled rotations, with weights (angles) defined by the distance to the
-        # control qubit. These angles are the negative of the angle used in the QFT.
-        # Start on the last qubit and iterate until the qubit after k.
-        # When num_qubits==1, this loop does not run.
-        for j in reversed(range(1, num_qubits - k)):
-            angle = -2 * math.pi / (2 ** (j + 1))
-            qft_circuit.cphaseshift(qubits[k + j], qubits[k], angle)
+    Args:
+        integer_N (int) : The integer N to be factored
+        guessed_factors (Set[int]) : Candidate factors of N
 
-        # Then add a Hadamard gate
-        qft_circuit.h(qubits[k])
+    Returns:
+        Optional[List[int]]: A pair of non-trivial factors whose product is N, None otherwise
+    """
+    for factor in sorted(guessed_factors):
+        if 1 < factor < integer_N and integer_N % factor == 0:
+            return [factor, integer_N // factor]
+    return None
 
-    return qft_circuit
+
+def validate_shor_inputs(integer_N: int, integer_a: int) -> None:
+    """
+    Validate the inputs of Shor's algorithm
+
+    Args:
+        integer_N (int) : The integer N to be factored
+        integer_a (int) : Any integer 'a' that satisfies 1 < a < N and gcd(a, N) = 1.
+    """
+    if integer_N < 1 or integer_N % 2 == 0:
+        raise ValueError("The input N needs to be an odd integer greater than 1.")
+    if integer_a >= integer_N or math.gcd(integer_a, integer_N) != 1:
+        raise ValueError('The integer "a" needs to satisfy 1 < a < N and gcd(a, N) = 1.')
+
+@circuit.subroutine(register=True)
+def inverse_qft_noswaps(qubits: QubitSetInput) -> Circuit:
+    """
+    Construct a circuit object corresponding to the inverse Quantum Fourier Transform (QFT)
+    algorithm, applied to the argument qubits.  The circuit is relabelled from the cached
+    template of circuit_library.
+
+    Args:
+        qubits (QubitSetInput): Qubits on which to apply the inverse Quantum Fourier Transform
+
+    Returns:
+        Circuit: Circuit object that implements the inverse Quantum Fourier Transform algorithm
+    """
+    return qft_circuit(qubits, inverse=True)
 
 @circuit.subroutine(register=True)
 def modular_exponentiation_amod15(
@@ -88,26 +262,44 @@ def modular_exponentiation_amod15(
 
     for x in counting_qubits:
         r = 2**x
-        if integer_a not in [2, 7, 8, 11, 13]:
+        if integer_a not in AMOD15_SWAPS:
             raise ValueError("integer 'a' must be 2,7,8,11 or 13")
         for iteration in range(r):
-            if integer_a in [2, 13]:
-                mod_exp_amod15.cswap(x, aux_qubits[0], aux_qubits[1])
-                mod_exp_amod15.cswap(x, aux_qubits[1], aux_qubits[2])
-                mod_exp_amod15.cswap(x, aux_qubits[2], aux_qubits[3])
-            if integer_a in [7, 8]:
-                mod_exp_amod15.cswap(x, aux_qubits[2], aux_qubits[3])
-                mod_exp_amod15.cswap(x, aux_qubits[1], aux_qubits[2])
-                mod_exp_amod15.cswap(x, aux_qubits[0], aux_qubits[1])
-            if integer_a == 11:
-                mod_exp_amod15.cswap(x, aux_qubits[1], aux_qubits[3])
-                mod_exp_amod15.cswap(x, aux_qubits[0], aux_qubits[2])
-            if integer_a in [7, 11, 13]:
+            for q0, q1 in AMOD15_SWAPS[integer_a]:
+                mod_exp_amod15.cswap(x, aux_qubits[q0], aux_qubits[q1])
+            if integer_a in AMOD15_FLIPS:
                 for q in aux_qubits:
                     mod_exp_amod15.cnot(x, q)
 
     return mod_exp_amod15
 
+
+def amod15_permutation(integer_a: int, num_aux_qubits: int) -> np.ndarray:
+    """
+    Permutation of the auxiliary register basis states applied by a single controlled
+    step of modular_exponentiation_amod15 (i.e. multiplication by a mod 15)
+
+    Args:
+        integer_a (int) : Any integer that satisfies 1 < a < N and gcd(a, N) = 1.
+        num_aux_qubits (int) : Number of qubits in the auxiliary register
+    Returns:
+        np.ndarray: perm[y] is the basis state that basis state y is mapped to
+    """
+    if integer_a not in AMOD15_SWAPS:
+        raise ValueError("integer 'a' must be 2,7,8,11 or 13")
+
+    perm = np.empty(2**num_aux_qubits, dtype=int)
+    for y in range(2**num_aux_qubits):
+        # aux_qubits[0] is the most significant bit of the basis index
+        bits = [(y >> (num_aux_qubits - 1 - i)) & 1 for i in range(num_aux_qubits)]
+        for q0, q1 in AMOD15_SWAPS[integer_a]:
+            bits[q0], bits[q1] = bits[q1], bits[q0]
+        if integer_a in AMOD15_FLIPS:
+            bits = [1 - b for b in bits]
+        perm[y] = int("".join(str(b) for b in bits), 2)
+
+    return perm
+
 @circuit.subroutine(register=True) 
 def shors_algorithm(integer_N: int, integer_a: int) -> Circuit:
     """
@@ -126,10 +318,7 @@ def shors_algorithm(integer_N: int, integer_a: int) -> Circuit:
     """
 
     # validate the inputs
-    if integer_N < 1 or integer_N % 2 == 0:
-        raise ValueError("The input N needs to be an odd integer greater than 1.")
-    if integer_a >= integer_N or math.gcd(integer_a, integer_N) != 1:
-        raise ValueError('The integer "a" needs to satisfy 1 < a < N and gcd(a, N) = 1.')
+    validate_shor_inputs(integer_N, integer_a)
 
     # calculate number of qubits needed
     n = int(np.ceil(np.log2(integer_N)))
@@ -152,3 +341,75 @@ def shors_algorithm(integer_N: int, integer_a: int) -> Circuit:
 
     return shors_circuit
 
+
+def semiclassical_shors_algorithm(
+    integer_N: int, integer_a: int, shots: int, seed: Optional[int] = None
+) -> Counter:
+    """
+    Local simulator driver for Shor's algorithm using the semiclassical QFT.
+    A single control qubit is recycled for every counting bit: for k = n-1 ... 0 it is
+    prepared in |+>, controls U^(2^k) on the auxiliary register, receives the phase
+    correction classically conditioned on the bits already measured, and is measured
+    after a Hadamard. Only n + 1 qubits are simulated instead of 2n.
+
+    Braket circuits cannot express mid-circuit measurement with classical feed-forward,
+    so the rounds are emulated here on a statevector of the auxiliary register, one per shot.
+
+    Args:
+        integer_N (int) : The integer N to be factored
+        integer_a (int) : Any integer 'a' that satisfies 1 < a < N and gcd(a, N) = 1.
+        shots (int) : Number of shots
+        seed (Optional[int]) : Seed of the random number generator
+
+    Returns:
+        Counter: measurement counts with the same bitstring layout as shors_algorithm
+            (counting bits followed by the auxiliary register)
+    """
+    validate_shor_inputs(integer_N, integer_a)
+
+    n = int(np.ceil(np.log2(integer_N)))
+    m = n
+    dim = 2**m
+    rng = np.random.default_rng(seed)
+
+    # U^(2^k) as basis permutations, by repeated squaring of U
+    powers = [amod15_permutation(integer_a, m)]
+    for _ in range(1, n):
+        powers.append(powers[-1][powers[-1]])
+
+    # aux register initialized with x on aux_qubits[0], one statevector per shot
+    states = np.zeros((shots, dim), dtype=complex)
+    states[:, 1 << (m - 1)] = 1.0
+    bits = np.zeros((shots, n), dtype=int)
+
+    for k in reversed(range(n)):
+        applied = np.empty_like(states)
+        applied[:, powers[k]] = states
+
+        # classically controlled phase corrections of the inverse QFT
+        omega = np.zeros(shots)
+        for j in range(1, n - k):
+            omega += bits[:, k + j] * 2 * math.pi / (2 ** (j + 1))
+        applied *= np.exp(-1j * omega)[:, None]
+
+        # Hadamard on the control qubit, then measure it
+        branch_0 = (states + applied) / 2
+        branch_1 = (states - applied) / 2
+        p_0 = np.sum(np.abs(branch_0) ** 2, axis=1)
+        outcome = rng.random(shots) >= p_0
+        bits[:, k] = outcome
+
+        norm = np.sqrt(np.where(outcome, 1 - p_0, p_0))
+        states = np.where(outcome[:, None], branch_1, branch_0) / norm[:, None]
+
+    # measure the auxiliary register
+    probabilities = np.abs(states) ** 2
+    cumulative = np.cumsum(probabilities, axis=1)
+    aux_values = (cumulative < rng.random(shots)[:, None] * cumulative[:, -1:]).sum(axis=1)
+
+    measurement_counts = Counter()
+    for shot_bits, aux in zip(bits, aux_values):
+        key = "".join(str(b) for b in shot_bits) + format(aux, f"0{m}b")
+        measurement_counts[key] += 1
+
+    return measurement_counts
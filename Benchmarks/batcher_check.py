@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Check of the IBM circuit batcher against the local Qiskit simulator.
+
+Submits circuits with known outcomes to a CircuitBatcher running on BasicSimulator and checks
+that concurrent circuits are coalesced into one job per shot count, that every caller gets the
+result of its own circuit, and that a failed job fails every circuit in it and no other:
+
+    python Benchmarks/batcher_check.py
+
+Exits with status 1 when a check fails.
+"""
+
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Callable, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'Utilidades'))
+
+from qiskit import QuantumCircuit
+from qiskit.providers.basic_provider import BasicSimulator
+
+from ibm_batch import CircuitBatcher, backend_executor
+
+N_QUBITS = 4
+# Long enough for every concurrent submission to join the same job
+MAX_WAIT = 0.5
+
+# ##############################################################################
+
+def basis_state_circuit(value: int) -> QuantumCircuit:
+    """Circuit always measuring value, as a Qiskit bitstring of N_QUBITS bits.
+    """
+    circuit = QuantumCircuit(N_QUBITS, N_QUBITS)
+    for qubit in range(N_QUBITS):
+        if value >> qubit & 1:
+            circuit.x(qubit)
+    circuit.measure(range(N_QUBITS), range(N_QUBITS))
+    return circuit
+
+
+class RecordingExecutor:
+    """ Runs the jobs on BasicSimulator and records their sizes and shots, failing the jobs
+    that contain a circuit named 'fail'.
+    """
+    def __init__(self):
+        self.run = backend_executor(BasicSimulator())
+        self.jobs = []
+        self._lock = Lock()
+
+    def __call__(self, circuits: List[QuantumCircuit], shots: int):
+        with self._lock:
+            self.jobs.append((len(circuits), shots))
+        if any(circuit.name == 'fail' for circuit in circuits):
+            raise RuntimeError('job failed')
+        return self.run(circuits, shots)
+
+
+def submit_all(batcher: CircuitBatcher, requests: List[Tuple[QuantumCircuit, int]]) -> List:
+    """Submit every (circuit, shots) from its own thread, as concurrent service requests do,
+    and return each result or exception.
+    """
+    def run(request):
+        try:
+            return batcher.run(*request, timeout=30)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(len(requests)) as executor:
+        return list(executor.map(run, requests))
+
+
+def check_coalescing() -> None:
+    execute = RecordingExecutor()
+    batcher = CircuitBatcher(execute, max_batch_size=20, max_wait=MAX_WAIT)
+    results = submit_all(batcher, [(basis_state_circuit(value), 10) for value in range(8)])
+
+    assert execute.jobs == [(8, 10)], f'expected one job of 8 circuits, got {execute.jobs}'
+    for value, result in enumerate(results):
+        expected = format(value, f'0{N_QUBITS}b')
+        assert result.get_memory() == [expected] * 10, f'circuit {value} got {result.get_counts()}'
+
+
+def check_shots_and_size() -> None:
+    execute = RecordingExecutor()
+    batcher = CircuitBatcher(execute, max_batch_size=3, max_wait=MAX_WAIT)
+    requests = [(basis_state_circuit(value), 5 if value % 2 else 7) for value in range(6)]
+    results = submit_all(batcher, requests)
+
+    assert all(size <= 3 for size, _ in execute.jobs), f'job over max_batch_size: {execute.jobs}'
+    assert sum(size for size, _ in execute.jobs) == 6, f'circuits lost or repeated: {execute.jobs}'
+    for (circuit, shots), result in zip(requests, results):
+        assert len(result.get_memory()) == shots, f'{circuit.name} got {len(result.get_memory())} shots'
+
+
+def check_errors() -> None:
+    execute = RecordingExecutor()
+    batcher = CircuitBatcher(execute, max_batch_size=20, max_wait=MAX_WAIT)
+    failing = basis_state_circuit(1)
+    failing.name = 'fail'
+    # The failing job only holds the circuits with its shot count
+    requests = [(failing, 3), (basis_state_circuit(2), 3), (basis_state_circuit(3), 4)]
+    results = submit_all(batcher, requests)
+
+    assert isinstance(results[0], RuntimeError) and isinstance(results[1], RuntimeError), results
+    assert results[2].get_memory() == ['0011'] * 4, results[2]
+    # The batcher keeps serving after a failed job
+    assert batcher.run(basis_state_circuit(5), 2, timeout=30).get_memory() == ['0101'] * 2
+
+
+CHECKS: List[Tuple[str, Callable[[], None]]] = [
+    ('coalescing and demultiplexing', check_coalescing),
+    ('shot groups and max_batch_size', check_shots_and_size),
+    ('error propagation', check_errors),
+]
+
+
+def main() -> int:
+    failed = 0
+    for name, check in CHECKS:
+        try:
+            check()
+            status = 'OK'
+        except AssertionError as e:
+            failed += 1
+            status = f'FAILED: {e}'
+        print(f'{name:<35} {status}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
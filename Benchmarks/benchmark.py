@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+Offline benchmark of the quantum services.
+
+Measures circuit construction, local simulation, post-processing and end-to-end time of
+every service hot path over a sweep of problem sizes, using only local simulators. Run it
+with the Python environment of the Zato server, since the service modules import Zato:
+
+    python Benchmarks/benchmark.py --output results.json
+    python Benchmarks/benchmark.py --compare results.json --tolerance 0.2
+
+Every record of the JSON output identifies a (benchmark, params, stage) and holds the
+minimum, median and mean of the repeated timings in seconds. --compare exits with status 1
+when a median is slower than the baseline by more than the tolerance.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ['Utilidades', 'Aleatoridad Cuantica', 'Algoritmo de Shor', 'Busqueda de Groover',
+               'Caminata Cuantica', 'QAOA']:
+    sys.path.insert(0, os.path.join(ROOT, folder))
+
+import numpy as np
+from braket.devices import LocalSimulator
+
+# Problem sizes of every sweep
+QAOA_QUBITS = [4, 6, 8]
+QAOA_LAYERS = [1, 2, 3]
+GROVER_QUBITS = [3, 5, 7]
+GROVER_SHOTS = [100, 1000]
+SHOR_BASES = [2, 7, 11, 13]
+SHOR_SHOTS = [100, 1000]
+WALK_NODES = [4, 16, 64]
+WALK_STEPS = [1, 4, 16]
+WALK_SHOTS = 1000
+QRNG_BITS = [128, 256, 384]
+
+# ##############################################################################
+
+def measure(function: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return {
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.fmean(timings),
+    }
+
+
+class Recorder:
+
+    def __init__(self, repeat: int):
+        self.repeat = repeat
+        self.records = []
+
+    def __call__(self, benchmark: str, params: Dict[str, Any], stage: str, function: Callable[[], Any]) -> None:
+        record = {'benchmark': benchmark, 'params': params, 'stage': stage}
+        record.update(measure(function, self.repeat))
+        self.records.append(record)
+        print(f"{benchmark:<8} {stage:<20} {json.dumps(params):<48} {record['median'] * 1000:10.3f} ms",
+              file=sys.stderr)
+
+# ##############################################################################
+
+def bench_qaoa(record: Recorder, device: LocalSimulator) -> None:
+    from qaoa import _qaoa_template, parameter_names
+    from qaoaIsing import IsingProblem
+
+    rng = np.random.default_rng(7)
+    for n_qubits in QAOA_QUBITS:
+        matrix = rng.random((n_qubits, n_qubits))
+        np.fill_diagonal(matrix, 0)
+        problem = IsingProblem(matrix)
+        coeffs = problem.weights
+        for n_layers in QAOA_LAYERS:
+            params = {'n_qubits': n_qubits, 'n_layers': n_layers}
+            values = rng.random(2 * n_layers)
+
+            def build():
+                circ = _qaoa_template(problem, n_layers)
+                return circ.make_bound_circuit(dict(zip(parameter_names(n_layers), values)))
+
+            def build_cold():
+                _qaoa_template.cache_clear()
+                return build()
+
+            circuit = build()
+            result = device.run(circuit, shots=0).result()
+
+            def post_process():
+                return np.dot(coeffs, [result_type.value for result_type in result.result_types])
+
+            record('qaoa', params, 'build_cold', build_cold)
+            record('qaoa', params, 'build', build)
+            record('qaoa', params, 'simulate', lambda: device.run(circuit, shots=0).result())
+            record('qaoa', params, 'post_process', post_process)
+            record('qaoa', params, 'end_to_end', lambda: np.dot(
+                coeffs, [result_type.value for result_type in device.run(build(), shots=0).result().result_types]
+            ))
+
+
+def bench_grover(record: Recorder, device: LocalSimulator) -> None:
+    import groover_search as grover
+
+    for n_qubits in GROVER_QUBITS:
+        solution = '1' * n_qubits
+        n_reps = grover.optimal_repetitions(n_qubits, 1)
+        for strategy in grover.MCZ_STRATEGIES:
+            def build():
+                oracle = grover.build_oracle(solution, strategy=strategy)
+                return grover.grovers_search(oracle, n_qubits, n_reps, strategy=strategy, probability=False)
+
+            def build_cold():
+                for builder in (grover._build_oracle, grover._amplify, grover._multi_control_z,
+                                grover._multi_control_not, grover._multi_control_not_adjoint,
+                                grover._multi_control_not_constructor):
+                    builder.cache_clear()
+                return build()
+
+            circuit = build()
+            for shots in GROVER_SHOTS:
+                params = {'n_qubits': n_qubits, 'strategy': strategy, 'shots': shots}
+                counts = device.run(circuit, shots=shots).result().measurement_counts
+
+                record('grover', params, 'build_cold', build_cold)
+                record('grover', params, 'build', build)
+                record('grover', params, 'simulate', lambda: device.run(circuit, shots=shots).result())
+                record('grover', params, 'post_process', lambda: grover.top_outcomes(counts, n_qubits, 3))
+                record('grover', params, 'end_to_end', lambda: grover.top_outcomes(
+                    device.run(build(), shots=shots).result().measurement_counts, n_qubits, 3
+                ))
+
+
+def bench_shor(record: Recorder, device: LocalSimulator) -> None:
+    import shor
+    from postProcesing import ShorPostProcesing
+
+    post_processing = ShorPostProcesing()
+    integer_N = 15
+    for integer_a in SHOR_BASES:
+        circuit = shor.shors_algorithm(integer_N, integer_a)
+        for shots in SHOR_SHOTS:
+            params = {'N': integer_N, 'a': integer_a, 'shots': shots}
+            results = {'measurement_counts': device.run(circuit, shots=shots).result().measurement_counts}
+
+            def end_to_end():
+                counts = device.run(shor.shors_algorithm(integer_N, integer_a), shots=shots).result().measurement_counts
+                return post_processing.get_factors_from_results(
+                    {'measurement_counts': counts}, integer_N, integer_a, False
+                )
+
+            record('shor', params, 'build', lambda: shor.shors_algorithm(integer_N, integer_a))
+            record('shor', params, 'simulate', lambda: device.run(circuit, shots=shots).result())
+            record('shor', params, 'get_phases',
+                   lambda: post_processing._get_phases(Counter(results['measurement_counts'])))
+            record('shor', params, 'post_process', lambda: post_processing.get_factors_from_results(
+                results, integer_N, integer_a, False
+            ))
+            record('shor', params, 'end_to_end', end_to_end)
+            record('shor', params, 'semiclassical',
+                   lambda: shor.semiclassical_shors_algorithm(integer_N, integer_a, shots))
+
+
+def bench_walk(record: Recorder, device: LocalSimulator) -> None:
+    import qwalk
+
+    for n_nodes in WALK_NODES:
+        for num_steps in WALK_STEPS:
+            params = {'n_nodes': n_nodes, 'num_steps': num_steps, 'shots': WALK_SHOTS}
+            circuit = qwalk.quantum_walk(n_nodes, num_steps)
+            measurements = device.run(circuit, shots=WALK_SHOTS).result().measurements
+
+            record('walk', params, 'build', lambda: qwalk.quantum_walk(n_nodes, num_steps))
+            record('walk', params, 'simulate', lambda: device.run(circuit, shots=WALK_SHOTS).result())
+            record('walk', params, 'post_process', lambda: qwalk.node_probabilities(measurements, n_nodes))
+            record('walk', params, 'end_to_end', lambda: qwalk.node_probabilities(
+                device.run(qwalk.quantum_walk(n_nodes, num_steps), shots=WALK_SHOTS).result().measurements,
+                n_nodes,
+            ))
+            record('walk', params, 'local_engine', lambda: qwalk.quantum_walk_distribution(n_nodes, num_steps))
+
+
+def bench_qrng(record: Recorder) -> None:
+    from ibm_batch import local_backend
+    from qrng import QuantumRandomNumberGeneratosService
+
+    backend = local_backend()
+    circuit = QuantumRandomNumberGeneratosService().circuit()
+    for bits in QRNG_BITS:
+        # quantum.quantum-aes draws 256 key bits and 128 IV bits per message
+        params = {'bits': bits}
+        memory = backend.run(circuit, shots=bits, memory=True).result().get_memory()
+
+        record('qrng', params, 'build', lambda: QuantumRandomNumberGeneratosService().circuit())
+        record('qrng', params, 'simulate', lambda: backend.run(circuit, shots=bits, memory=True).result())
+        record('qrng', params, 'post_process', lambda: int(''.join(memory), base=2))
+        record('qrng', params, 'end_to_end', lambda: int(
+            ''.join(backend.run(circuit, shots=bits, memory=True).result().get_memory()), base=2
+        ))
+
+# ##############################################################################
+
+BENCHMARKS = ['qaoa', 'grover', 'shor', 'walk', 'qrng']
+
+
+def compare(records: List[Dict[str, Any]], baseline_path: str, tolerance: float) -> int:
+    with open(baseline_path) as f:
+        baseline = {
+            (r['benchmark'], json.dumps(r['params'], sort_keys=True), r['stage']): r
+            for r in json.load(f)['records']
+        }
+
+    regressions = 0
+    for r in records:
+        previous = baseline.get((r['benchmark'], json.dumps(r['params'], sort_keys=True), r['stage']))
+        if previous and r['median'] > previous['median'] * (1 + tolerance):
+            regressions += 1
+            print(f"REGRESSION {r['benchmark']} {r['stage']} {json.dumps(r['params'])}: "
+                  f"{previous['median'] * 1000:.3f} ms -> {r['median'] * 1000:.3f} ms", file=sys.stderr)
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='timings per measurement')
+    parser.add_argument('--only', default=','.join(BENCHMARKS), help='comma separated benchmarks to run')
+    parser.add_argument('--output', help='JSON file the results are written to, stdout by default')
+    parser.add_argument('--compare', help='baseline JSON file to compare the medians with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative slowdown')
+    args = parser.parse_args()
+
+    record = Recorder(args.repeat)
+    device = LocalSimulator()
+    selected = args.only.split(',')
+
+    if 'qaoa' in selected:
+        bench_qaoa(record, device)
+    if 'grover' in selected:
+        bench_grover(record, device)
+    if 'shor' in selected:
+        bench_shor(record, device)
+    if 'walk' in selected:
+        bench_walk(record, device)
+    if 'qrng' in selected:
+        bench_qrng(record)
+
+    output = {'repeat': args.repeat, 'python': sys.version.split()[0], 'records': record.records}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+    else:
+        json.dump(output, sys.stdout, indent=2)
+
+    if args.compare:
+        return 1 if compare(record.records, args.compare, args.tolerance) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Import-time budget of the service modules.
+
+Imports every service module in a fresh interpreter, with Zato already loaded as it is in a
+server worker, and compares the best time of several runs with the budget of the module.
+Heavy dependencies only some requests need (matplotlib, SciPy, Qiskit, Braket devices) are
+imported on first use, so they must not show up here. Run it with the Python environment of
+the Zato server:
+
+    python Benchmarks/import_budget.py
+    python Benchmarks/import_budget.py --repeat 5 --only qaoa,qrng
+
+Exits with status 1 when a module is over its budget or fails to import.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FOLDERS = ['Utilidades', 'Aleatoridad Cuantica', 'Algoritmo de Shor', 'Busqueda de Groover',
+           'Caminata Cuantica', 'QAOA']
+
+# Import-time budget of every module in milliseconds. Modules registering Braket subroutines
+# load braket.circuits, about 1.5 s, the rest only NumPy at most
+BRAKET_BUDGET = 2500
+LIGHT_BUDGET = 250
+BUDGETS = {
+    'qaoa': BRAKET_BUDGET,
+    'qaoaCostFunction': BRAKET_BUDGET,
+    'qaoaDecode': BRAKET_BUDGET,
+    'shor': BRAKET_BUDGET,
+    'groover_search': BRAKET_BUDGET,
+    'qwalk': BRAKET_BUDGET,
+    'qaoaCreateImage': LIGHT_BUDGET,
+    'qaoaOutputMail': LIGHT_BUDGET,
+    'qaoaShowImage': LIGHT_BUDGET,
+    'qaoaMultiStart': LIGHT_BUDGET,
+    'qaoaOptimizer': LIGHT_BUDGET,
+    'qaoaProgress': LIGHT_BUDGET,
+    'qaoaQrngInput': LIGHT_BUDGET,
+    'qrng': LIGHT_BUDGET,
+    'qrng_health': LIGHT_BUDGET,
+    'aes': LIGHT_BUDGET,
+    'ibm_groover_search': LIGHT_BUDGET,
+    'postProcesing': LIGHT_BUDGET,
+    'service_metrics': LIGHT_BUDGET,
+    'ibm_batch': LIGHT_BUDGET,
+    'result_cache': LIGHT_BUDGET,
+    'device_routing': LIGHT_BUDGET,
+}
+
+IMPORT = """
+import time
+import zato.server.service
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+# ##############################################################################
+
+class ImportFailed(Exception):
+    """ The import of a module exited with an error, the message is its stderr.
+    """
+
+
+def import_time(module: str) -> float:
+    """Seconds taken to import a module in a fresh interpreter.
+    Raises:
+        ImportFailed: When the import exits with a non-zero status
+    """
+    path = os.pathsep.join([os.path.join(ROOT, folder) for folder in FOLDERS] + [os.environ.get('PYTHONPATH', '')])
+    output = subprocess.run(
+        [sys.executable, '-c', IMPORT.format(module=module)],
+        capture_output=True, text=True, env=dict(os.environ, PYTHONPATH=path),
+    )
+    if output.returncode:
+        raise ImportFailed(output.stderr.strip())
+    return float(output.stdout.split()[-1])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3, help='imports per module, the best one is kept')
+    parser.add_argument('--only', default=','.join(BUDGETS), help='comma separated modules to measure')
+    args = parser.parse_args()
+
+    failed = 0
+    for module in args.only.split(','):
+        budget = BUDGETS[module]
+        try:
+            milliseconds = min(import_time(module) for _ in range(args.repeat)) * 1000
+        except ImportFailed as e:
+            failed += 1
+            print(f'{module:<20} {"":>13} {budget:8d} ms  IMPORT FAILED')
+            print('    ' + str(e).replace('\n', '\n    '))
+            continue
+        status = 'OK' if milliseconds <= budget else 'OVER BUDGET'
+        failed += milliseconds > budget
+        print(f'{module:<20} {milliseconds:10.1f} ms {budget:8d} ms  {status}')
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
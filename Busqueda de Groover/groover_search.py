@@ -1,35 +1,178 @@
 # -*- coding: utf-8 -*-
 # zato: ide-deploy=True
-import json
-from typing import Tuple
+import math
+from functools import lru_cache
+from collections import Counter
+from typing import Dict, List, Sequence, Tuple
 
+import numpy as np
 from braket.circuits import Circuit
 
 
 # Zato
-from zato.server.service import AWSQuantumService
+from zato.server.service import AWSQuantumService, Service
+
+from device_routing import DeviceRoutingMixin
+from result_cache import ResultCacheMixin
+from service_metrics import TimedServiceMixin
 
 # ##############################################################################
 
-class GrooverSearch(AWSQuantumService):
-    """ Returns details of a user by the person's ID.
+class GrooverSearch(TimedServiceMixin, DeviceRoutingMixin, ResultCacheMixin, AWSQuantumService):
+    """ Searches the marked solutions of an oracle with Grover's algorithm.
     """
     name = 'quantum.groover-search'
     runs = 100
     quantum_computer = 'arn:aws:braket:::device/quantum-simulator/amazon/sv1'
     key_name = 'key'
     threshold = 0.8
+    solutions = ['010']
+    # Multi-controlled Z synthesis, None selects it from quantum_computer
+    mcz_strategy = None
 
     def circuit(self):
-        return grovers_search(build_oracle('010'), 2)
-    
+        payload = self.request.payload or {}
+        self.solutions = sorted(set(payload.get('solutions', self.solutions)))
+        self.n_qubits = int(payload.get('n_qubits', len(self.solutions[0])))
+        self.threshold = float(payload.get('threshold', self.threshold))
+
+        if any(len(solution) != self.n_qubits for solution in self.solutions):
+            raise ValueError('Every solution must have n_qubits bits')
+
+        strategy = self.mcz_strategy or select_mcz_strategy(self.quantum_computer)
+        self.n_reps = repetitions_for_threshold(self.n_qubits, len(self.solutions), self.threshold)
+        oracle = _build_multi_oracle(tuple(self.solutions), False, strategy)
+        # Only measurement counts are used, the 2^n probability result type is not requested
+        return grovers_search(oracle, self.n_qubits, self.n_reps, strategy=strategy, probability=False)
+
     def after_circuit_execution(self):
-        self.logger.info(str(dict(self.circuit_result.measurement_counts)))
-        self.response.payload = str(dict(self.circuit_result.measurement_counts))
+        # Ancilla qubits of the 'ancilla' strategy are measured too, they are always returned to |0>
+        measurement_counts = dict(self.circuit_result.measurement_counts)
+        hits = sum(
+            count for bitstring, count in measurement_counts.items()
+            if bitstring[:self.n_qubits] in self.solutions
+        )
+        success_probability = hits / sum(measurement_counts.values())
+
+        output = {
+            "n_qubits": self.n_qubits,
+            "n_reps": self.n_reps,
+            "expected_success_probability": success_probability_after(
+                self.n_qubits, len(self.solutions), self.n_reps
+            ),
+            "success_probability": success_probability,
+            "threshold_reached": success_probability >= self.threshold,
+        }
+        top_k = (self.request.payload or {}).get('top_k')
+        if top_k:
+            output["top_outcomes"] = top_outcomes(measurement_counts, self.n_qubits, int(top_k))
+        else:
+            output["measurement_counts"] = measurement_counts
+        self.logger.info(
+            'Grover n_qubits=%s n_reps=%s: success probability %.3f', self.n_qubits, self.n_reps, success_probability
+        )
+        self.response.payload = output
+
+
+class GrooverSequentialSearch(Service):
+    """ Runs quantum.groover-search in small shot batches and stops as soon as the
+    leading outcome is known with the requested confidence.
+    """
+    name = 'quantum.groover-search-sequential'
+    batch_runs = 10
+    max_runs = 100
+    threshold = 0.8
+    top_k = 3
+    # Normal quantile of the Wilson score bound used as confidence
+    z_score = 1.96
+
+    def handle(self):
+        payload = dict(self.request.payload or {})
+        threshold = float(payload.pop('threshold', self.threshold))
+        top_k = int(payload.pop('top_k', self.top_k))
+        batch_runs = int(payload.pop('batch_runs', self.batch_runs))
+        max_runs = int(payload.pop('max_runs', self.max_runs))
+        if batch_runs < 1 or max_runs < 1:
+            raise ValueError('batch_runs and max_runs must be at least 1')
+
+        counts = Counter()
+        shots = 0
+        confidence = 0.0
+        while shots < max_runs:
+            runs = min(batch_runs, max_runs - shots)
+            response = self.invoke('quantum.groover-search', payload, runs=runs)
+            # Ancilla bits are dropped so that the leader is a data register outcome
+            for bitstring, count in response['measurement_counts'].items():
+                counts[bitstring[:response['n_qubits']]] += count
+            shots += runs
+
+            leader_count = counts.most_common(1)[0][1]
+            confidence = wilson_lower_bound(leader_count, shots, self.z_score)
+            if confidence >= threshold:
+                break
+
+        self.response.payload = {
+            "top_outcomes": top_outcomes(counts, response['n_qubits'], top_k),
+            "shots": shots,
+            "confidence": confidence,
+            "threshold_reached": confidence >= threshold,
+        }
+
+# Maximum number of memoized oracle, diffuser and multi-control circuits kept per builder.
+# Builders return copies of the memoized circuits, so callers are free to modify them.
+CACHE_SIZE = 128
+
+# Multi-controlled Z synthesis strategies:
+#   'ancilla'  - recursive Toffoli construction, adds ancilla qubits (any gate-model device)
+#   'native'   - single Z gate with control modifiers, no ancilla (devices supporting them)
+#   'diagonal' - the whole phase oracle as one diagonal unitary, no ancilla. Only used when
+#                requested: the local simulator applies the dense unitary slower than the
+#                controlled gates of 'native' at every register size
+MCZ_STRATEGIES = ('ancilla', 'native', 'diagonal')
+
+
+def select_mcz_strategy(device: str) -> str:
+    """Choose the multi-controlled Z synthesis supported by a device: 'native' when it
+    advertises the OpenQASM control modifier, 'ancilla' otherwise.
+    Args:
+        device (str): 'LocalSimulator' or the ARN of a Braket device.
+    Returns:
+        str: One of MCZ_STRATEGIES
+    """
+    return 'native' if supports_control_modifier(device) else 'ancilla'
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def supports_control_modifier(device: str) -> bool:
+    """Whether a device lists the 'ctrl' gate modifier among the supported modifiers of its
+    OpenQASM action, read once per device. Devices whose properties cannot be read are assumed
+    not to support it.
+    Args:
+        device (str): 'LocalSimulator' or the ARN of a Braket device.
+    Returns:
+        bool: True when 'native' circuits can run on the device
+    """
+    try:
+        if device == 'LocalSimulator':
+            from braket.devices import LocalSimulator
+            properties = LocalSimulator().properties
+        else:
+            from braket.aws import AwsDevice
+            properties = AwsDevice(device).properties
+        action = properties.action.get('braket.ir.openqasm.program')
+    except Exception:
+        return False
+    modifiers = getattr(action, 'supportedModifiers', None) or []
+    return any(getattr(modifier, 'name', None) == 'ctrl' for modifier in modifiers)
 
 
 def grovers_search(
-    oracle: Circuit, n_qubits: int, n_reps: int = 1, decompose_ccnot: bool = False
+    oracle: Circuit,
+    n_qubits: int,
+    n_reps: int = 1,
+    decompose_ccnot: bool = False,
+    strategy: str = 'ancilla',
+    probability: bool = True,
 ) -> Circuit:
     """Generate Grover's circuit for a target solution and oracle.
     Args:
@@ -37,44 +180,180 @@ def grovers_search(
         n_qubits (int): Number of data qubits.
         n_reps (int): Number of repititions for amplification. Defaults to 1.
         decompose_ccnot (bool): To decompose CCNOT (Toffoli) gate in the circuit.
+        strategy (str): Multi-controlled Z synthesis of the amplifier, one of MCZ_STRATEGIES.
+        probability (bool): Whether to add the probability result type of the data qubits.
     Returns:
         Circuit: Grover's circuit
     """
     grover_circ = Circuit().h(range(n_qubits))
+    amplification = _amplify(n_qubits, decompose_ccnot, strategy)
     for _ in range(n_reps):
         grover_circ.add(oracle)
-        amplification = amplify(n_qubits, decompose_ccnot)
         grover_circ.add(amplification)
-    grover_circ.probability(range(n_qubits))
+    if probability:
+        grover_circ.probability(range(n_qubits))
     return grover_circ
 
 
-def build_oracle(solution: str, decompose_ccnot: bool = False) -> Circuit:
+def top_outcomes(measurement_counts: Dict[str, int], n_qubits: int, k: int) -> List[Dict]:
+    """Most frequent outcomes of the data register.
+    Args:
+        measurement_counts (Dict[str, int]): Measurement counts, possibly including ancilla qubits.
+        n_qubits (int): Number of data qubits.
+        k (int): Number of outcomes to return.
+    Returns:
+        List[Dict]: bitstring, count and probability of the k most frequent outcomes
+    """
+    data_counts = Counter()
+    for bitstring, count in measurement_counts.items():
+        data_counts[bitstring[:n_qubits]] += count
+    shots = sum(data_counts.values())
+    return [
+        {"bitstring": bitstring, "count": count, "probability": count / shots}
+        for bitstring, count in data_counts.most_common(k)
+    ]
+
+
+def wilson_lower_bound(successes: int, trials: int, z_score: float) -> float:
+    """Lower end of the Wilson score interval of a binomial proportion.
+    Args:
+        successes (int): Number of successes.
+        trials (int): Number of trials.
+        z_score (float): Normal quantile of the interval.
+    Returns:
+        float: Lower bound of the proportion
+    """
+    if trials == 0:
+        return 0.0
+    p = successes / trials
+    z2 = z_score**2
+    centre = p + z2 / (2 * trials)
+    margin = z_score * math.sqrt(p * (1 - p) / trials + z2 / (4 * trials**2))
+    return (centre - margin) / (1 + z2 / trials)
+
+
+def build_oracle(
+    solution: str, decompose_ccnot: bool = False, strategy: str = 'ancilla'
+) -> Circuit:
     """Oracle circuit of a given solution.
     Args:
         solution (str): Target solution (e.g., '010')
         decompose_ccnot (bool): Whether to decompose CCNOT (Toffoli) gate in the circuit.
+        strategy (str): Multi-controlled Z synthesis, one of MCZ_STRATEGIES.
     Returns:
         Circuit: Oracle circuit
     """
+    return _build_oracle(solution, decompose_ccnot, strategy).copy()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _build_oracle(solution: str, decompose_ccnot: bool, strategy: str = 'ancilla') -> Circuit:
+    if strategy == 'diagonal':
+        return _diagonal_phase_oracle((solution,))
+
     x_idx = [i for i, s in enumerate(solution) if s == "0"]
 
     circ = Circuit()
     n_qubit = len(solution)
-    mcz = multi_control_z(n_qubit, decompose_ccnot)
+    mcz = _multi_control_z(n_qubit, decompose_ccnot, strategy)
     circ.x(x_idx).add_circuit(mcz).x(x_idx)
     return circ
 
 
-def amplify(n_qubits: int, decompose_ccnot: bool) -> Circuit:
+def build_multi_oracle(
+    solutions: Sequence[str], decompose_ccnot: bool = False, strategy: str = 'ancilla'
+) -> Circuit:
+    """Phase oracle marking every solution of a set.
+    Args:
+        solutions (Sequence[str]): Target solutions (e.g., ['010', '111'])
+        decompose_ccnot (bool): Whether to decompose CCNOT (Toffoli) gate in the circuit.
+        strategy (str): Multi-controlled Z synthesis, one of MCZ_STRATEGIES.
+    Returns:
+        Circuit: Oracle circuit
+    """
+    return _build_multi_oracle(tuple(sorted(set(solutions))), decompose_ccnot, strategy).copy()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _build_multi_oracle(
+    solutions: Tuple[str, ...], decompose_ccnot: bool, strategy: str = 'ancilla'
+) -> Circuit:
+    if strategy == 'diagonal':
+        return _diagonal_phase_oracle(solutions)
+
+    # Every single-solution oracle flips the phase of its own basis state only
+    circ = Circuit()
+    for solution in solutions:
+        circ.add_circuit(_build_oracle(solution, decompose_ccnot, strategy))
+    return circ
+
+
+def _diagonal_phase_oracle(solutions: Tuple[str, ...]) -> Circuit:
+    """Phase oracle as a single diagonal unitary on the data register (qubit 0 is the
+    most significant bit of the basis index).
+    """
+    n_qubits = len(solutions[0])
+    phases = np.ones(2**n_qubits)
+    phases[[int(solution, 2) for solution in solutions]] = -1
+    return Circuit().unitary(matrix=np.diag(phases), targets=range(n_qubits))
+
+
+def optimal_repetitions(n_qubits: int, n_solutions: int) -> int:
+    """Optimal number of amplification rounds, floor(pi/4 * sqrt(N/M)).
+    Args:
+        n_qubits (int): Number of data qubits.
+        n_solutions (int): Number of marked solutions.
+    Returns:
+        int: Number of repetitions
+    """
+    return int(math.floor(math.pi / 4 * math.sqrt(2**n_qubits / n_solutions)))
+
+
+def success_probability_after(n_qubits: int, n_solutions: int, n_reps: int) -> float:
+    """Probability of measuring a marked solution after n_reps amplification rounds.
+    Args:
+        n_qubits (int): Number of data qubits.
+        n_solutions (int): Number of marked solutions.
+        n_reps (int): Number of repetitions for amplification.
+    Returns:
+        float: Success probability
+    """
+    theta = math.asin(math.sqrt(n_solutions / 2**n_qubits))
+    return math.sin((2 * n_reps + 1) * theta) ** 2
+
+
+def repetitions_for_threshold(n_qubits: int, n_solutions: int, threshold: float) -> int:
+    """Smallest number of amplification rounds whose success probability reaches threshold,
+    capped at the optimal number of rounds.
+    Args:
+        n_qubits (int): Number of data qubits.
+        n_solutions (int): Number of marked solutions.
+        threshold (float): Target success probability.
+    Returns:
+        int: Number of repetitions
+    """
+    max_reps = optimal_repetitions(n_qubits, n_solutions)
+    for n_reps in range(max_reps + 1):
+        if success_probability_after(n_qubits, n_solutions, n_reps) >= threshold:
+            return n_reps
+    return max_reps
+
+
+def amplify(n_qubits: int, decompose_ccnot: bool, strategy: str = 'ancilla') -> Circuit:
     """Perform a single iteration of amplitude amplification.
     Args:
         n_qubits (int): Number of data qubits.
         decompose_ccnot (bool): Whether to decompose CCNOT (Toffoli) gate in the circuit.
+        strategy (str): Multi-controlled Z synthesis, one of MCZ_STRATEGIES.
     Returns:
         Circuit: Amplification circuit.
     """
-    oracle = build_oracle(n_qubits * "0", decompose_ccnot)
+    return _amplify(n_qubits, decompose_ccnot, strategy).copy()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _amplify(n_qubits: int, decompose_ccnot: bool, strategy: str = 'ancilla') -> Circuit:
+    oracle = _build_oracle(n_qubits * "0", decompose_ccnot, strategy)
     circ = Circuit()
     circ.h(range(n_qubits))
     circ.add_circuit(oracle)
@@ -125,6 +404,16 @@ def multi_control_not_constructor(
     Returns:
         Tuple[Circuit, int]:  the multi-contol Not circuit and the number of ancilla in the circuit
     """
+    circ, n_ancilla = _multi_control_not_constructor(n_qubit, decompose_ccnot, is_outermost_call)
+    return circ.copy(), n_ancilla
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _multi_control_not_constructor(
+    n_qubit: int,
+    decompose_ccnot: bool,
+    is_outermost_call: bool,
+) -> Tuple[Circuit, int]:
     if n_qubit == 1:
         n_ancilla = 1
         circ = Circuit().cnot(0, 1)
@@ -141,8 +430,8 @@ def multi_control_not_constructor(
         nq1 = n_qubit // 2
         nq2 = n_qubit - nq1
 
-        circ1, na1 = multi_control_not_constructor(nq1, decompose_ccnot, is_outermost_call=False)
-        circ2, na2 = multi_control_not_constructor(nq2, decompose_ccnot, is_outermost_call=False)
+        circ1, na1 = _multi_control_not_constructor(nq1, decompose_ccnot, False)
+        circ2, na2 = _multi_control_not_constructor(nq2, decompose_ccnot, False)
 
         circ = Circuit()
 
@@ -164,8 +453,8 @@ def multi_control_not_constructor(
         n_ancilla += 1
 
         if is_outermost_call:
-            circ.add_circuit(circ2.adjoint(), target=qd2 + qa2)
-            circ.add_circuit(circ1.adjoint(), target=qd1 + qa1)
+            circ.add_circuit(_multi_control_not_adjoint(nq2, decompose_ccnot), target=qd2 + qa2)
+            circ.add_circuit(_multi_control_not_adjoint(nq1, decompose_ccnot), target=qd1 + qa1)
 
         return circ, n_ancilla
 
@@ -178,19 +467,44 @@ def multi_control_not(n_qubit: int, decompose_ccnot: bool) -> Circuit:
     Returns:
         Circuit:  multi-contol Not circuit
     """
-    mcx_circ, _ = multi_control_not_constructor(n_qubit, decompose_ccnot, is_outermost_call=True)
+    return _multi_control_not(n_qubit, decompose_ccnot).copy()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _multi_control_not_adjoint(n_qubit: int, decompose_ccnot: bool) -> Circuit:
+    circ, _ = _multi_control_not_constructor(n_qubit, decompose_ccnot, False)
+    return circ.adjoint()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _multi_control_not(n_qubit: int, decompose_ccnot: bool) -> Circuit:
+    mcx_circ, _ = _multi_control_not_constructor(n_qubit, decompose_ccnot, True)
     return mcx_circ
 
 
-def multi_control_z(n_qubit: int, decompose_ccnot: bool) -> Circuit:
+def multi_control_z(n_qubit: int, decompose_ccnot: bool, strategy: str = 'ancilla') -> Circuit:
     """Multi-control Z circuit.
     Args:
         n_qubit (int): Number of qubits.
         decompose_ccnot (bool): To decompose CCNOT (Toffoli) gate in the circuit.
+        strategy (str): Synthesis strategy, one of MCZ_STRATEGIES. 'native' and 'diagonal'
+            act on the n_qubit qubits only, 'ancilla' adds ancilla qubits.
     Returns:
         Circuit:  multi-contol Z circuit
     """
-    mcz_circ = multi_control_not(n_qubit, decompose_ccnot)
+    return _multi_control_z(n_qubit, decompose_ccnot, strategy).copy()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _multi_control_z(n_qubit: int, decompose_ccnot: bool, strategy: str = 'ancilla') -> Circuit:
+    if strategy not in MCZ_STRATEGIES:
+        raise ValueError(f"Unknown multi-control Z strategy '{strategy}'")
+    if strategy == 'native':
+        return Circuit().z(n_qubit - 1, control=range(n_qubit - 1))
+    if strategy == 'diagonal':
+        return _diagonal_phase_oracle((n_qubit * "1",))
+
+    mcz_circ = _multi_control_not(n_qubit, decompose_ccnot)
     z_target = mcz_circ.qubit_count - 1
 
     circ = Circuit()
@@ -1,51 +1,190 @@
 # -*- coding: utf-8 -*-
 # zato: ide-deploy=True
-import json
-from typing import Tuple
+import math
+from collections import OrderedDict
+from threading import Lock
+from typing import TYPE_CHECKING, Any, Callable, Hashable, Optional, Sequence, Tuple
 
-from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister
+if TYPE_CHECKING:
+    from qiskit import QuantumCircuit, QuantumRegister
 
 
 # Zato
 from zato.server.service import IBMQuantumService
 
+from ibm_batch import BatchedExecutionMixin, local_backend
+from service_metrics import TimedServiceMixin
+
 # ##############################################################################
 
-class GrooverSearch(IBMQuantumService):
-    """ Returns details of a user by the person's ID.
+class GrooverSearch(TimedServiceMixin, IBMQuantumService):
+    """ Searches the marked states of an oracle with Grover's algorithm.
     """
     name = 'ibm_quantum.groover-search'
     runs = 100
     quantum_computer = 'ibmq_qasm_simulator'
     key_name = 'ibm_quantum'
     threshold = 0.8
+    marked = ['00']
+    optimization_level = 1
 
     def circuit(self):
+        payload = self.request.payload or {}
+        marked = tuple(sorted(set(payload.get('marked', self.marked))))
+        n_qubits = int(payload.get('n_qubits', len(marked[0])))
+        optimization_level = int(payload.get('optimization_level', self.optimization_level))
 
-        qreg_q = QuantumRegister(2, 'q')
-        creg_c = ClassicalRegister(2, 'c')
-        circuit = QuantumCircuit(qreg_q, creg_c)
-
-        circuit.h(qreg_q[1])
-        circuit.h(qreg_q[0])
-        circuit.x(qreg_q[1])
-        circuit.x(qreg_q[0])
-        circuit.cz(qreg_q[0], qreg_q[1])
-        circuit.x(qreg_q[0])
-        circuit.x(qreg_q[1])
-        circuit.h(qreg_q[0])
-        circuit.h(qreg_q[1])
-        circuit.z(qreg_q[0])
-        circuit.z(qreg_q[1])
-        circuit.cz(qreg_q[0], qreg_q[1])
-        circuit.h(qreg_q[0])
-        circuit.h(qreg_q[1])
-        circuit.measure(qreg_q[0], creg_c[0])
-        circuit.measure(qreg_q[1], creg_c[1])
+        if any(len(state) != n_qubits for state in marked):
+            raise ValueError('Every marked state must have n_qubits bits')
+
+        return transpiled_grover_circuit(
+            self.quantum_computer, n_qubits, marked, optimization_level, self.get_transpile_backend()
+        )
+
+    def get_transpile_backend(self) -> Optional[Any]:
+        """Qiskit backend whose target and coupling map the circuit is transpiled for. The IBM
+        backend is resolved by the Zato service on submission, so the default is None, the
+        generic BASIS_GATES target.
+        """
+        return None
 
-        return circuit
-    
 
     def after_circuit_execution(self):
-        self.logger.info(str(self.circuit_result.get_counts()))
-        self.response.payload = str(self.circuit_result.get_counts())
+        counts = self.circuit_result.get_counts()
+        self.logger.info('Grover %s: most frequent outcome %s', self.name, max(counts, key=counts.get))
+        self.response.payload = str(counts)
+
+
+class BatchedGrooverSearch(BatchedExecutionMixin, GrooverSearch):
+    """ Grover search coalescing concurrent requests into multi-circuit jobs.
+    """
+    name = 'ibm_quantum.groover-search-batched'
+
+    def get_transpile_backend(self) -> Optional[Any]:
+        return local_backend() if self.use_local_backend else None
+
+
+# ##############################################################################
+
+# Basis of IBM Quantum backends, the generic target circuits are transpiled to when the backend
+# they are submitted to is not known
+BASIS_GATES = ['id', 'rz', 'sx', 'x', 'cx']
+
+
+class TranspileCache:
+    """ Bounded LRU cache of transpiled circuits.
+    """
+    def __init__(self, maxsize: int = 64):
+        self.maxsize = maxsize
+        self._circuits = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Hashable, build: Callable[[], 'QuantumCircuit']) -> 'QuantumCircuit':
+        """Return a copy of the cached circuit for key, building it on a miss.
+        Args:
+            key (Hashable): Cache key
+            build (Callable[[], 'QuantumCircuit']): Builds and transpiles the circuit
+        Returns:
+            QuantumCircuit: Transpiled circuit
+        """
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is not None:
+                self._circuits.move_to_end(key)
+                return circuit.copy()
+
+        circuit = build()
+
+        with self._lock:
+            self._circuits[key] = circuit
+            self._circuits.move_to_end(key)
+            while len(self._circuits) > self.maxsize:
+                self._circuits.popitem(last=False)
+
+        return circuit.copy()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._circuits.clear()
+
+
+transpile_cache = TranspileCache()
+
+
+def transpiled_grover_circuit(
+    backend_name: str,
+    n_qubits: int,
+    marked: Tuple[str, ...],
+    optimization_level: int = 1,
+    backend: Optional[Any] = None,
+) -> 'QuantumCircuit':
+    """Grover's circuit transpiled for the target and coupling map of a backend, or to
+    BASIS_GATES without one, cached per (backend name, n_qubits, marked states, optimization level).
+    Args:
+        backend_name (str): Name of the backend the circuit is submitted to
+        n_qubits (int): Number of qubits
+        marked (Tuple[str, ...]): Marked states, as Qiskit bitstrings (qubit 0 is the rightmost bit)
+        optimization_level (int): Qiskit transpiler optimization level
+        backend (Optional[Any]): Qiskit backend the circuit is submitted to. Default is None
+    Returns:
+        QuantumCircuit: Transpiled Grover's circuit
+    """
+    from qiskit import transpile
+
+    target = {'backend': backend} if backend is not None else {'basis_gates': BASIS_GATES}
+    key = (backend.name if backend is not None else backend_name, n_qubits, marked, optimization_level)
+    return transpile_cache.get(
+        key,
+        lambda: transpile(grover_circuit(n_qubits, marked), optimization_level=optimization_level, **target),
+    )
+
+
+def grover_circuit(n_qubits: int, marked: Sequence[str], n_reps: int = None) -> 'QuantumCircuit':
+    """Grover's circuit for a set of marked states.
+    Args:
+        n_qubits (int): Number of qubits
+        marked (Sequence[str]): Marked states, as Qiskit bitstrings (qubit 0 is the rightmost bit)
+        n_reps (int): Number of repetitions for amplification. Defaults to floor(pi/4 * sqrt(N/M)).
+    Returns:
+        QuantumCircuit: Grover's circuit measuring every qubit
+    """
+    from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister
+
+    if n_reps is None:
+        n_reps = int(math.floor(math.pi / 4 * math.sqrt(2**n_qubits / len(marked))))
+
+    qreg_q = QuantumRegister(n_qubits, 'q')
+    creg_c = ClassicalRegister(n_qubits, 'c')
+    circuit = QuantumCircuit(qreg_q, creg_c)
+
+    circuit.h(qreg_q)
+    for _ in range(n_reps):
+        for state in marked:
+            phase_flip(circuit, qreg_q, state)
+        # Diffuser
+        circuit.h(qreg_q)
+        phase_flip(circuit, qreg_q, '0' * n_qubits)
+        circuit.h(qreg_q)
+    circuit.measure(qreg_q, creg_c)
+
+    return circuit
+
+
+def phase_flip(circuit: 'QuantumCircuit', qreg_q: 'QuantumRegister', state: str) -> None:
+    """Flip the phase of a single basis state.
+    Args:
+        circuit (QuantumCircuit): Circuit the gates are appended to
+        qreg_q (QuantumRegister): Register of the state
+        state (str): Qiskit bitstring of the state (qubit 0 is the rightmost bit)
+    """
+    zeros = [qreg_q[i] for i, bit in enumerate(reversed(state)) if bit == '0']
+    if zeros:
+        circuit.x(zeros)
+    if len(qreg_q) == 1:
+        circuit.z(qreg_q[0])
+    else:
+        circuit.h(qreg_q[-1])
+        circuit.mcx(list(qreg_q[:-1]), qreg_q[-1])
+        circuit.h(qreg_q[-1])
+    if zeros:
+        circuit.x(zeros)
@@ -1,89 +1,132 @@
 # -*- coding: utf-8 -*-
 # zato: ide-deploy=True
 
-from braket.circuits.circuit import Circuit
+from functools import lru_cache
 
 import numpy as np
 from braket.circuits import Circuit
 
-from zato.server.service import AWSQuantumService
+from zato.server.service import AWSQuantumService, Service
 
-class QuantumWalk(AWSQuantumService):
+from circuit_library import approximation_degree_for, qft_circuit
+from device_routing import DeviceRoutingMixin
+from result_cache import ResultCacheMixin
+from service_metrics import TimedServiceMixin
 
+class QuantumWalk(Service):
+    """ Quantum random walk on a cycle. The node distribution is computed exactly by the
+    local engine unless the request asks for a device run with 'device': True.
+    """
     name = 'quantum.quantum-walk'
+    n_nodes = 4
+    num_steps = 1
+
+    def handle(self):
+        payload = self.request.payload or {}
+        if payload.get('device'):
+            self.response.payload = self.invoke('quantum.quantum-walk-device', payload)
+            return
+
+        n_nodes = int(payload.get('n_nodes', self.n_nodes))
+        num_steps = int(payload.get('num_steps', self.num_steps))
+        probabilities = quantum_walk_distribution(n_nodes, num_steps)
+
+        output = {
+            "n_nodes": n_nodes,
+            "num_steps": num_steps,
+            "quantum_walk_measurement_counts": dict(enumerate(probabilities.tolist())),
+        }
+        self.response.payload = str(output)
+
+
+class QuantumWalkDevice(TimedServiceMixin, DeviceRoutingMixin, ResultCacheMixin, AWSQuantumService):
+
+    name = 'quantum.quantum-walk-device'
     runs = 1000
     quantum_computer = 'arn:aws:braket:::device/quantum-simulator/amazon/sv1'
     key_name = 'key'
+    n_nodes = 4
+    num_steps = 1
+    # Approximate QFT, controlled phases below this angle are dropped, see quantum_walk
+    precision = 0.0
+    # 'full' returns the whole task result as a string, 'compact' only the node
+    # distribution as JSON types, without the raw per-shot measurements
+    response_mode = 'full'
 
     def circuit(self) -> Circuit:
-        return quantum_walk(4)
+        payload = self.request.payload or {}
+        self.n_nodes = int(payload.get('n_nodes', self.n_nodes))
+        self.num_steps = int(payload.get('num_steps', self.num_steps))
+        self.precision = float(payload.get('precision', self.precision))
+        return quantum_walk(self.n_nodes, self.num_steps, self.precision)
 
     def after_circuit_execution(self):
-
-        # get measurement results
-        measurement_counts = self.circuit_result.measurement_counts
-
-        quantum_walk_measurement_counts = {}
-        for key, val in self.circuit_result.measurement_counts.items():
-            node = int(key[1:][::-1], 2)
-            if node in quantum_walk_measurement_counts:
-                quantum_walk_measurement_counts[node] += val / self.get_runs()
-            else:
-                quantum_walk_measurement_counts[node] = val / self.get_runs()
+        payload = self.request.payload or {}
+        probabilities = node_probabilities(self.circuit_result.measurements, self.n_nodes)
+
+        if payload.get('response_mode', self.response_mode) == 'compact':
+            self.response.payload = {
+                "n_nodes": self.n_nodes,
+                "num_steps": self.num_steps,
+                "precision": self.precision,
+                "shots": len(self.circuit_result.measurements),
+                "quantum_walk_probabilities": probabilities.tolist(),
+            }
+            return
 
         output = {
             "task_metadata": self.circuit_result.task_metadata,
             "measurements": self.circuit_result.measurements,
             "measured_qubits": self.circuit_result.measured_qubits,
-            "measurement_counts": measurement_counts,
+            "measurement_counts": self.circuit_result.measurement_counts,
             "measurement_probabilities": self.circuit_result.measurement_probabilities,
-            "quantum_walk_measurement_counts": quantum_walk_measurement_counts,
+            "quantum_walk_measurement_counts": {
+                node: probability for node, probability in enumerate(probabilities.tolist()) if probability
+            },
         }
         self.response.payload = str(output)
-        
 
 
-def qft(num_qubits: int, inverse: bool = False) -> Circuit:
-    """Creates the quantum Fourier transform circuit and its inverse.
+def node_probabilities(measurements: np.ndarray, n_nodes: int) -> np.ndarray:
+    """Marginal node distribution of the quantum walk measurements.
 
     Args:
-        num_qubits (int): Number of qubits in the circuit
-        inverse (bool): If true return the inverse of the circuit. Default is False
+        measurements (np.ndarray): Per-shot measurements, one column per qubit, the coin first
+            and the node register after it, least significant bit first
+        n_nodes (int): The number of nodes in the graph
 
     Returns:
-        Circuit: Circuit object that implements the quantum Fourier transform or its inverse
+        np.ndarray: Frequency of every node
     """
+    measurements = np.asarray(measurements, dtype=np.int64)
+    weights = np.left_shift(1, np.arange(measurements.shape[1] - 1))
+    nodes = measurements[:, 1:] @ weights
+    return np.bincount(nodes, minlength=n_nodes) / len(measurements)
 
-    qc = Circuit()
-    N = num_qubits - 1
 
-    if not inverse:
-        qc.h(N)
-        for n in range(1, N + 1):
-            qc.cphaseshift(N - n, N, 2 * np.pi / 2 ** (n + 1))
+# Maximum number of shift circuits, step operators and eigendecompositions kept in memory
+CACHE_SIZE = 32
 
-        for i in range(1, N):
-            qc.h(N - i)
-            for n in range(1, N - i + 1):
-                qc.cphaseshift(N - (n + i), N - i, 2 * np.pi / 2 ** (n + 1))
-        qc.h(0)
 
-    else:  # The inverse of the quantum Fourier transform
-        qc.h(0)
-        for i in range(N - 1, 0, -1):
-            for n in range(N - i, 0, -1):
-                qc.cphaseshift(N - (n + i), N - i, -2 * np.pi / 2 ** (n + 1))
-            qc.h(N - i)
+def qft(num_qubits: int, inverse: bool = False, precision: float = 0.0) -> Circuit:
+    """Creates the quantum Fourier transform circuit and its inverse.
 
-        for n in range(N, 0, -1):
-            qc.cphaseshift(N - n, N, -2 * np.pi / 2 ** (n + 1))
+    Args:
+        num_qubits (int): Number of qubits in the circuit
+        inverse (bool): If true return the inverse of the circuit. Default is False
+        precision (float): Controlled phases with an angle below it are dropped
+            (approximate QFT). Default is 0.0, the exact QFT
 
-        qc.h(N)
+    Returns:
+        Circuit: Circuit object that implements the quantum Fourier transform or its inverse
+    """
 
-    return qc
+    # The transform starts from the last qubit
+    degree = approximation_degree_for(num_qubits, precision)
+    return qft_circuit(range(num_qubits - 1, -1, -1), inverse=inverse, approximation_degree=degree)
 
 
-def qft_conditional_add_1(num_qubits: int) -> Circuit:
+def qft_conditional_add_1(num_qubits: int, precision: float = 0.0) -> Circuit:
     """Creates the quantum circuit that conditionally add +1 or -1 using:
 
     1) The first qubit to control if add 1 or subtract 1: when the first qubit is 0, we add 1 from
@@ -93,30 +136,38 @@ def qft_conditional_add_1(num_qubits: int) -> Circuit:
 
     Args:
         num_qubits (int): Number of qubits that saves the result.
+        precision (float): Controlled phases of the QFT with an angle below it are dropped.
 
     Returns:
         Circuit: Circuit object that implements the circuit that conditionally add +1 or -1.
     """
+    return _qft_conditional_add_1(num_qubits, precision).copy()
 
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _qft_conditional_add_1(num_qubits: int, precision: float) -> Circuit:
     qc = Circuit()
-    qc.add(qft(num_qubits), target=range(1, num_qubits + 1))
+    qc.add(qft(num_qubits, precision=precision), target=range(1, num_qubits + 1))
 
     # add \pm 1 with control phase gates
     for i in range(num_qubits):
         qc.cphaseshift01(control=0, target=num_qubits - i, angle=2 * np.pi / 2 ** (num_qubits - i))
         qc.cphaseshift(control=0, target=num_qubits - i, angle=-2 * np.pi / 2 ** (num_qubits - i))
 
-    qc.add(qft(num_qubits, inverse=True), target=range(1, num_qubits + 1))
+    qc.add(qft(num_qubits, inverse=True, precision=precision), target=range(1, num_qubits + 1))
 
     return qc
 
 
-def quantum_walk(n_nodes: int, num_steps: int = 1) -> Circuit:
-    """Creates the quantum random walk circuit.
+def quantum_walk(n_nodes: int, num_steps: int = 1, precision: float = 0.0) -> Circuit:
+    """Creates the quantum random walk circuit. The inverse QFT closing every step cancels
+    against the QFT opening the next one, so only the first QFT and the last inverse QFT remain.
 
     Args:
         n_nodes (int): The number of nodes in the graph
         num_steps (int): The number of steps for the quantum walk. Default is 1
+        precision (float): Controlled phases of the QFT with an angle below it are dropped.
+            Default is 0.0, the exact QFT
 
     Returns:
         Circuit: Circuit object that implements the quantum random walk algorithm
@@ -132,10 +183,120 @@ def quantum_walk(n_nodes: int, num_steps: int = 1) -> Circuit:
     else:
         raise ValueError("The number of nodes has to be 2^n for integer n.")
 
+    shift = _qft_conditional_add_1(n, precision)
+
     qc = Circuit()
     for _ in range(num_steps):
         qc.h(0)
-        qc.add_circuit(qft_conditional_add_1(n))
+        qc.add_circuit(shift)
         qc.x(0)  # flip the coin after the shift
 
-    return qc
\ No newline at end of file
+    return cancel_inverse_pairs(qc)
+
+
+def cancel_inverse_pairs(circuit: Circuit) -> Circuit:
+    """Peephole pass removing every pair of mutually inverse gates acting on the same qubits
+    with no other gate on those qubits in between (gates on other qubits commute with them).
+
+    Args:
+        circuit (Circuit): Circuit without result types
+
+    Returns:
+        Circuit: Equivalent circuit without the cancelled pairs
+    """
+    instructions = []
+    # indices of the live instructions acting on each qubit, most recent last
+    qubit_stacks = {}
+
+    for instruction in circuit.instructions:
+        qubits = list(instruction.control) + list(instruction.target)
+        latest = {qubit_stacks[q][-1] if qubit_stacks.get(q) else None for q in qubits}
+
+        if len(latest) == 1 and None not in latest:
+            index = latest.pop()
+            previous = instructions[index]
+            if len(previous.control) + len(previous.target) == len(qubits) and _is_inverse(
+                previous, instruction
+            ):
+                instructions[index] = None
+                for q in qubits:
+                    qubit_stacks[q].pop()
+                continue
+
+        instructions.append(instruction)
+        for q in qubits:
+            qubit_stacks.setdefault(q, []).append(len(instructions) - 1)
+
+    return Circuit([instruction for instruction in instructions if instruction is not None])
+
+
+def _is_inverse(first, second) -> bool:
+    return (
+        first.target == second.target
+        and first.control == second.control
+        and first.control_state == second.control_state
+        and first.power == second.power
+        and first.operator.adjoint() == [second.operator]
+    )
+
+
+# From this number of steps on, the walk is evolved through the eigendecomposition
+# of the step operator instead of by repeated multiplication
+EIGEN_MIN_STEPS = 64
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def walk_step_operator(n_nodes: int) -> np.ndarray:
+    """Unitary of a single step of the quantum walk circuit on a cycle of n_nodes nodes:
+    Hadamard coin, shift by +1 (coin 0) or -1 (coin 1), then coin flip.
+
+    Args:
+        n_nodes (int): The number of nodes in the cycle
+
+    Returns:
+        np.ndarray: Step operator on the coin x node space, basis index coin * n_nodes + node
+    """
+    identity = np.eye(n_nodes)
+    hadamard = np.array([[1, 1], [1, -1]]) / np.sqrt(2)
+    coin_flip = np.array([[0, 1], [1, 0]])
+
+    shift = np.zeros((2 * n_nodes, 2 * n_nodes))
+    for node in range(n_nodes):
+        shift[(node + 1) % n_nodes, node] = 1
+        shift[n_nodes + (node - 1) % n_nodes, n_nodes + node] = 1
+
+    return np.kron(coin_flip, identity) @ shift @ np.kron(hadamard, identity)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _walk_eigendecomposition(n_nodes: int):
+    eigenvalues, eigenvectors = np.linalg.eig(walk_step_operator(n_nodes))
+    return eigenvalues, eigenvectors, np.linalg.inv(eigenvectors)
+
+
+def quantum_walk_distribution(n_nodes: int, num_steps: int = 1) -> np.ndarray:
+    """Exact node distribution of the quantum walk started at node 0 with coin |0>.
+
+    Args:
+        n_nodes (int): The number of nodes in the cycle, any integer greater than 1
+        num_steps (int): The number of steps for the quantum walk. Default is 1
+
+    Returns:
+        np.ndarray: Probability of measuring each node
+    """
+    if n_nodes < 2:
+        raise ValueError("The number of nodes has to be at least 2.")
+
+    state = np.zeros(2 * n_nodes, dtype=complex)
+    state[0] = 1.0
+
+    if num_steps < EIGEN_MIN_STEPS:
+        step = walk_step_operator(n_nodes)
+        for _ in range(num_steps):
+            state = step @ state
+    else:
+        eigenvalues, eigenvectors, eigenvectors_inv = _walk_eigendecomposition(n_nodes)
+        state = eigenvectors @ (eigenvalues**num_steps * (eigenvectors_inv @ state))
+
+    amplitudes = state.reshape(2, n_nodes)
+    return np.sum(np.abs(amplitudes) ** 2, axis=0)
@@ -1,72 +1,108 @@
 # -*- coding: utf-8 -*-
 # zato: ide-deploy=True
 from dataclasses import dataclass
-from braket.tasks import GateModelQuantumTaskResult
-from braket.circuits.circuit import Circuit
+from functools import lru_cache
 import numpy as np
 from braket.circuits import Circuit, FreeParameter, Observable, circuit
 
 from zato.server.service import AWSQuantumService, Model
 from zato.common.typing_ import list_
 
+from qaoaIsing import IsingProblem
+from result_cache import ResultCache, ResultCacheMixin
+from service_metrics import TimedServiceMixin
+
+# Maximum number of parametric QAOA circuits kept in memory
+CACHE_SIZE = 32
+
 @dataclass(init=False)
 class TaskResult(Model):
-    result:  GateModelQuantumTaskResult
+    # Expectation value of every ZZ result type, in the order of IsingProblem.edges
+    values: list_[float]
+    shots: int = 0
+    # Whether the result was served from the result cache
+    cached: bool = False
+    # Measured bits of every shot, only for sampled runs (shots > 0)
+    measurements: list_[list_[int]] = None
 
 @dataclass(init=False)
 class Input(Model):
     n_qubits: int
     n_layers: int
+    # Ising matrix or IsingProblem
     matrix: np.ndarray
     values: np.ndarray
 
-class QAOA(AWSQuantumService):
+class QAOA(TimedServiceMixin, ResultCacheMixin, AWSQuantumService):
 
     name = 'qaoa.qaoa'
     runs = 0
     quantum_computer = 'LocalSimulator'
     key_name = 'key'
     input = Input
+    # Exact expectation values (shots=0) are deterministic
+    result_cache = ResultCache()
 
     def circuit(self) -> Circuit:
         request = self.request.input
-        circ = qaoa(request.n_qubits,request.n_layers, request.matrix)
-        fixed_circuit = circ.make_bound_circuit(
-            dict(zip(np.array(list(circ.parameters), dtype=str), request.values))
-        )
+        circ = _qaoa_template(IsingProblem.coerce(request.matrix), request.n_layers)
+        fixed_circuit = circ.make_bound_circuit(dict(zip(parameter_names(request.n_layers), request.values)))
         return fixed_circuit
     
     def after_circuit_execution(self):
         response = TaskResult()
-        response.result = self.circuit_result
+        response.values = [float(result_type.value) for result_type in self.circuit_result.result_types]
+        response.shots = self.get_runs()
+        response.cached = self.result_cache_hit
+        if response.shots:
+            response.measurements = np.asarray(self.circuit_result.measurements).tolist()
         self.response.payload = response
     
+def parameter_names(n_layers: int) -> list:
+    """Names of the free parameters of the QAOA template, in the order of the values vector.
+
+    Args:
+        n_layers (int): Number of layers
+
+    Returns:
+        list: gamma_0 ... gamma_{n_layers - 1}, beta_0 ... beta_{n_layers - 1}
+    """
+    return [f"gamma_{p}" for p in range(n_layers)] + [f"beta_{p}" for p in range(n_layers)]
+
+
 def qaoa(n_qubits: int, n_layers: int, ising: np.ndarray) -> Circuit:
     """QAOA template.
 
     Args:
         n_qubits (int): Number of qubits
         n_layers (int): Number of layers. Defaults to 1.
-        ising (ndarray): Ising interaction matrix.
+        ising (ndarray): Ising interaction matrix or IsingProblem.
 
     Returns:
         Circuit: The parameteric QAOA Circuit
     """
+    problem = IsingProblem.coerce(ising)
+    if problem.n_qubits != n_qubits:
+        raise ValueError(f'The Ising matrix has {problem.n_qubits} qubits, expected {n_qubits}')
+    return _qaoa_template(problem, n_layers).copy()
+
 
+@lru_cache(maxsize=CACHE_SIZE)
+def _qaoa_template(problem: IsingProblem, n_layers: int) -> Circuit:
+    # Shared by every caller, make_bound_circuit returns a new circuit
+    n_qubits = problem.n_qubits
     gammas = [FreeParameter(f"gamma_{p}") for p in range(n_layers)]
     betas = [FreeParameter(f"beta_{p}") for p in range(n_layers)]
 
     circ = Circuit()
     circ.h(range(n_qubits))  # prepare |+> state
     for gamma, beta in zip(gammas, betas):
-        circ.cost_layer(gamma, ising)
+        circ.cost_layer(gamma, problem)
         circ.driver_layer(beta, n_qubits)
 
-    # add Result types
-    idx = ising.nonzero()
-    for qubit_pair in zip(idx[0], idx[1]):
-        # get interaction strength from Ising matrix
-        circ.expectation(observable=Observable.Z() @ Observable.Z(), target=qubit_pair)
+    # add Result types, one per interacting pair
+    for i, j, _ in problem.edges:
+        circ.expectation(observable=Observable.Z() @ Observable.Z(), target=[i, j])
     return circ
 
 
@@ -93,20 +129,15 @@ def cost_layer(
 
     Args:
         gamma (float): Rotation angle to apply parameterized rotation around z
-        ising (np.ndarray): Ising matrix
+        ising (np.ndarray): Ising matrix or IsingProblem
 
     Returns:
         Circuit: Circuit for evolution with cost Hamiltonian
     """
     circ = Circuit()
-    # get all non-zero entries (edges) from Ising matrix
-    idx = ising.nonzero()
-    edges = list(zip(idx[0], idx[1]))
-    # apply ZZ gate for every edge (with corresponding interaction strength)
-    for qubit_pair in edges:
-        # get interaction strength from Ising matrix
-        interaction_strength = ising[qubit_pair[0], qubit_pair[1]]
-        circ.decomposed_zz_gate(qubit_pair[0], qubit_pair[1], gamma * interaction_strength)
+    # apply one ZZ gate per interacting pair, J_ij and J_ji merged as ZZ gates commute
+    for i, j, interaction_strength in IsingProblem.coerce(ising).edges:
+        circ.decomposed_zz_gate(i, j, gamma * interaction_strength)
     return circ
 
 
@@ -2,11 +2,12 @@
 # zato: ide-deploy=True
 import json
 import numpy as np
-from typing import List
 
-from scipy.optimize import minimize
 from qaoaQrngInput import Output
 from qaoa import Input
+from qaoaIsing import IsingProblem
+from qaoaOptimizer import OptimizerController
+from qaoaProgress import BUFFER_SIZE, progress
 
 from zato.server.service import Service
 
@@ -16,50 +17,98 @@ class QaoaCostFunction(Service):
     name = 'qaoa.qaoa-cost-function'
 
     input = Output
+    # Services invoked asynchronously with every cost evaluation, see qaoa.qaoa-progress
+    progress_subscribers = []
+    progress_buffer_size = BUFFER_SIZE
+    # Optimizer, a key of qaoaOptimizer.OPTIMIZERS, and its budget. None disables a limit
+    optimizer = 'Nelder-Mead'
+    max_evaluations = 150
+    max_seconds = 600
+    max_tasks = None
+    max_shots = None
+    # The optimization stops when the best cost improves less than plateau_tolerance
+    # (relative) over plateau_window evaluations
+    plateau_window = 30
+    plateau_tolerance = 1e-6
+    shots = 0
+    # Start from the best parameters of qaoa.qaoa-multi-start instead of random ones
+    warm_start = False
+    # Add the lowest energy assignments of the optimized circuit, see qaoa.qaoa-decode
+    decode = True
 
     def handle(self):
 
         input = self.request.input
-        self.coupling_matrix = input.matrix
         self.n_qubits = input.n_qubits
         self.n_layers = input.n_layers
 
-        self.coupling_matrix = np.array(self.coupling_matrix, dtype=float)
+        # Built once per job and passed to qaoa.qaoa in place of the matrix
+        self.problem = IsingProblem(input.matrix)
+        coeffs = self.problem.weights
 
-        np.fill_diagonal(self.coupling_matrix, 0)
+        if self.warm_start:
+            init_values = np.array(self.invoke('qaoa.qaoa-multi-start', input)["params"])
+        else:
+            init_values = np.random.rand(2 * self.n_layers)
 
-        idx = self.coupling_matrix.nonzero()
-        coeffs = [self.coupling_matrix[qubit_pair] for qubit_pair in zip(idx[0], idx[1])]
-
-        init_values = np.random.rand(2 * self.n_layers)
+        # The progress of the optimization is published under the CID of this request
+        self.progress = progress.open(
+            self.cid,
+            maxsize=self.progress_buffer_size,
+            subscribers=self.progress_subscribers,
+            notify=self.invoke_async,
+        )
+        controller = OptimizerController(
+            optimizer=self.optimizer,
+            max_evaluations=self.max_evaluations,
+            max_seconds=self.max_seconds,
+            max_tasks=self.max_tasks,
+            max_shots=self.max_shots,
+            plateau_window=self.plateau_window,
+            plateau_tolerance=self.plateau_tolerance,
+            should_stop=lambda: self.progress.cancelled,
+        )
+        try:
+            result = controller.minimize(lambda values: self.cost_function(values, coeffs, self.shots),
+                                         init_values, self.shots)
+        finally:
+            self.progress.finished = True
 
-        losses = []
-        result = minimize(
-                self.cost_function,
-                init_values,
-                args=(coeffs, losses, 0),  # shots=0
-                options={"disp": True, "maxfev": 150},
-                method="Nelder-Mead",
-        # bounds=bounds, # optional, some optimizers can use bounds
+        self.logger.info(
+            'QAOA optimization %s: %s after %d cost evaluations in %.1f s, best cost %s',
+            self.cid, result.reason, result.evaluations, result.elapsed, result.fun
         )
-        self.logger.info(str(losses))
-        self.invoke_async('qaoa.qaoa-create-image', json.dumps(losses))
-        
+        self.response.payload = {
+            "job": self.cid,
+            "params": result.x.tolist(),
+            "cost": result.fun,
+            "evaluations": result.evaluations,
+            "reason": result.reason,
+        }
+        if not result.evaluations:
+            return
+
+        if self.decode:
+            request = Input()
+            request.n_qubits = self.n_qubits
+            request.n_layers = self.n_layers
+            request.matrix = self.problem
+            request.values = result.x
+            self.response.payload["solutions"] = self.invoke('qaoa.qaoa-decode', request)["solutions"]
+
+        self.invoke_async('qaoa.qaoa-create-image', json.dumps(self.progress.costs()))
+
     def cost_function(
         self,
         values: np.ndarray,
         coeffs: np.ndarray,
-        cost_history: List[float],
         shots: int = 0
     ) -> float:
-        """Cost function and append to loss history list.
+        """Cost function, publishing every evaluation to the progress channel of the request.
 
         Args:
             values (ndarray): Values for the parameters.
-            device (Device): Braket device to run on.
-            circ (Circuit): QAOA circuit to run.
             coeffs (ndarray): The coefficients of the cost Hamiltonian.
-            cost_history (List[float]): History of cost evaluations.
             shots (int): Number of shots. Defaults to 0.
 
         Returns:
@@ -68,10 +117,9 @@ class QaoaCostFunction(Service):
         request = Input()
         request.n_qubits = self.n_qubits
         request.n_layers = self.n_layers
-        request.matrix = self.coupling_matrix
+        request.matrix = self.problem
         request.values = values
         response = self.invoke('qaoa.qaoa', request)
-        exp_vals = response.result.result_types
-        cost = sum(c * s.value for c, s in zip(coeffs, exp_vals))
-        cost_history.append(cost)
-        return cost
\ No newline at end of file
+        cost = float(np.dot(coeffs, response.values))
+        self.progress.publish(values, cost)
+        return cost
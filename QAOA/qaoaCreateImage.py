@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 # zato: ide-deploy=True
 import json
-import matplotlib.pyplot as plt
 
 from zato.server.service import Service
 
@@ -10,6 +9,9 @@ class QaoaCreateImage(Service):
     name = 'qaoa.qaoa-create-image'
 
     def handle(self):
+        # matplotlib is only loaded by the first request, not by every deploy of the module
+        import matplotlib.pyplot as plt
+
         losses = json.loads(self.request.payload)
         plt.plot(losses, "-o")
         plt.ylabel("Cost")
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+# zato: ide-deploy=True
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from qaoa import Input
+from qaoaIsing import IsingProblem
+from qaoaLocalEngine import qaoa_statevector
+
+from zato.server.service import Service
+
+# ##############################################################################
+
+def bits_to_spins(bits: np.ndarray) -> np.ndarray:
+    """Spins of measured bitstrings, +1 for |0> and -1 for |1>.
+    Args:
+        bits (ndarray): Matrix of shots x qubits with values 0 and 1
+    Returns:
+        ndarray: Matrix of shots x qubits with values +1 and -1
+    """
+    return 1 - 2 * np.asarray(bits, dtype=np.int8)
+
+
+def indices_to_bits(indices: np.ndarray, n_qubits: int) -> np.ndarray:
+    """Bits of basis state indices, qubit 0 being the most significant bit.
+    Args:
+        indices (ndarray): Basis state indices
+        n_qubits (int): Number of qubits
+    Returns:
+        ndarray: Matrix of indices x qubits with values 0 and 1
+    """
+    shifts = np.arange(n_qubits - 1, -1, -1)
+    return ((np.asarray(indices)[:, None] >> shifts) & 1).astype(np.int8)
+
+
+def greedy_refine(ising: np.ndarray, spins: np.ndarray, max_sweeps: Optional[int] = None) -> np.ndarray:
+    """Local search flipping, in every assignment at once, the spin that lowers its energy the most
+    until no flip lowers it.
+
+    Flipping spin k changes the energy by -2 s_k (S (J + J^T))_k, the local fields S (J + J^T)
+    being updated after every flip instead of recomputed.
+
+    Args:
+        ising (ndarray): Ising interaction matrix or IsingProblem
+        spins (ndarray): Matrix of assignments x qubits with values +1 and -1
+        max_sweeps (int): Maximum number of flips per assignment. Default is None, no limit
+
+    Returns:
+        ndarray: Refined assignments
+    """
+    spins = np.array(spins, dtype=float)
+    coupling = IsingProblem.coerce(ising).coupling
+    fields = spins @ coupling
+    rows = np.arange(spins.shape[0])
+
+    # Every flip lowers the energy, so the search ends without a limit too
+    sweeps = 0
+    while max_sweeps is None or sweeps < max_sweeps:
+        sweeps += 1
+        deltas = -2 * spins * fields
+        flip = deltas.argmin(axis=1)
+        improving = deltas[rows, flip] < -1e-12
+        if not improving.any():
+            break
+        rows_to_flip, qubits_to_flip = rows[improving], flip[improving]
+        fields[rows_to_flip] -= 2 * spins[rows_to_flip, qubits_to_flip, None] * coupling[qubits_to_flip]
+        spins[rows_to_flip, qubits_to_flip] *= -1
+
+    return spins
+
+
+def top_assignments(
+    ising: np.ndarray,
+    bits: np.ndarray,
+    top_k: int = 5,
+    refine: bool = False,
+    max_sweeps: Optional[int] = None,
+) -> List[Dict]:
+    """Lowest energy assignments among the measured bitstrings.
+
+    Args:
+        ising (ndarray): Ising interaction matrix or IsingProblem
+        bits (ndarray): Matrix of shots x qubits with values 0 and 1
+        top_k (int): Number of assignments returned. Default is 5
+        refine (bool): Whether to refine the sampled assignments with greedy_refine. Default is False
+        max_sweeps (int): Maximum number of flips per assignment of greedy_refine. Default is None
+
+    Returns:
+        List[Dict]: Bitstring, energy, number of shots and frequency of the assignments, lowest energy
+            first. Refined assignments count the shots of every bitstring they were refined from
+    """
+    problem = IsingProblem.coerce(ising)
+    unique_bits, counts = np.unique(np.asarray(bits, dtype=np.int8), axis=0, return_counts=True)
+    spins = bits_to_spins(unique_bits)
+
+    if refine:
+        spins = greedy_refine(problem, spins, max_sweeps)
+        spins, inverse = np.unique(spins, axis=0, return_inverse=True)
+        counts = np.bincount(inverse.reshape(-1), weights=counts).astype(int)
+
+    # Energies of every assignment in one vectorized pass
+    energies = problem.spin_energies(spins)
+    order = np.lexsort((-counts, energies))[:top_k]
+    total = counts.sum()
+    return [
+        {
+            "bitstring": ''.join('1' if s < 0 else '0' for s in spins[i]),
+            "energy": float(energies[i]),
+            "count": int(counts[i]),
+            "probability": float(counts[i] / total),
+        }
+        for i in order
+    ]
+
+
+def sample_local(ising: np.ndarray, values: np.ndarray, shots: int, seed: Optional[int] = None) -> np.ndarray:
+    """Measurements of the QAOA circuit sampled from the exact statevector of the local engine.
+    Args:
+        ising (ndarray): Ising interaction matrix or IsingProblem
+        values (ndarray): gamma_0 ... gamma_{p - 1}, beta_0 ... beta_{p - 1}
+        shots (int): Number of shots
+        seed (int): Seed of the sampling. Default is None
+    Returns:
+        ndarray: Matrix of shots x qubits with values 0 and 1
+    """
+    problem = IsingProblem.coerce(ising)
+    state = qaoa_statevector(problem.energies, problem.n_qubits, np.asarray(values, dtype=float))
+    probabilities = state.real**2 + state.imag**2
+    indices = np.random.default_rng(seed).choice(len(probabilities), size=shots, p=probabilities / probabilities.sum())
+    return indices_to_bits(indices, problem.n_qubits)
+
+
+class QaoaDecode(Service):
+    """ Samples the QAOA circuit with the optimized parameters and returns its lowest energy
+    assignments. The circuit is sampled by the local engine, or by qaoa.qaoa when device is set.
+    """
+    name = 'qaoa.qaoa-decode'
+
+    input = Input
+    shots = 1000
+    top_k = 5
+    # Greedy single spin flips of the sampled assignments, see greedy_refine
+    refine = False
+    device = False
+
+    def handle(self):
+        input = self.request.input
+        ising = IsingProblem.coerce(input.matrix)
+
+        if self.device:
+            response = self.invoke('qaoa.qaoa', input, runs=self.shots)
+            bits = np.asarray(response.measurements)
+        else:
+            bits = sample_local(ising, input.values, self.shots)
+
+        solutions = top_assignments(ising, bits, self.top_k, self.refine)
+        self.logger.info('QAOA decode: best assignment %s with energy %s', solutions[0]["bitstring"],
+                         solutions[0]["energy"])
+        self.response.payload = {"solutions": solutions}
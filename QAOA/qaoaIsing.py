@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# zato: ide-deploy=True
+from typing import Any, List, Tuple
+
+import numpy as np
+
+# ##############################################################################
+
+class IsingProblem:
+    """ Immutable, hashable cost Hamiltonian of a QAOA job, sum of J_ij Z_i Z_j over the non-zero
+    off-diagonal entries of an Ising matrix, built once per job.
+
+    The Hamiltonian is kept in its symmetric-merged form, one edge i < j of weight J_ij + J_ji
+    per interacting pair, which is what the circuit, the cost and the energies use. Two problems
+    are equal when their merged forms are. The dense matrices and the diagonal energy vector are
+    computed on first use and are not pickled.
+    """
+    __slots__ = ('n_qubits', 'rows', 'cols', 'weights', '_hash', '_coupling', '_energies')
+
+    def __init__(self, matrix: Any):
+        ising = np.array(matrix, dtype=float)
+        if ising.ndim != 2 or ising.shape[0] != ising.shape[1]:
+            raise ValueError(f'The Ising matrix must be square, got shape {ising.shape}')
+
+        upper = np.triu(ising + ising.T, k=1)
+        rows, cols = upper.nonzero()
+        self._init(ising.shape[0], rows, cols, upper[rows, cols])
+
+    def _init(self, n_qubits: int, rows: np.ndarray, cols: np.ndarray, weights: np.ndarray) -> None:
+        rows, cols, weights = (np.array(a, dtype=dtype) for a, dtype in zip((rows, cols, weights), (int, int, float)))
+        for array in (rows, cols, weights):
+            array.flags.writeable = False
+        setattr_ = super().__setattr__
+        setattr_('n_qubits', int(n_qubits))
+        setattr_('rows', rows)
+        setattr_('cols', cols)
+        setattr_('weights', weights)
+        setattr_('_hash', hash((self.n_qubits, rows.tobytes(), cols.tobytes(), weights.tobytes())))
+        setattr_('_coupling', None)
+        setattr_('_energies', None)
+
+    @classmethod
+    def from_edges(cls, n_qubits: int, rows: np.ndarray, cols: np.ndarray, weights: np.ndarray) -> 'IsingProblem':
+        """Problem from its merged edges, rows[k] < cols[k] with weight weights[k].
+        """
+        problem = cls.__new__(cls)
+        problem._init(n_qubits, rows, cols, weights)
+        return problem
+
+    @classmethod
+    def coerce(cls, ising: Any) -> 'IsingProblem':
+        """The problem itself, or the problem of an Ising matrix given as an array or nested lists.
+        """
+        return ising if isinstance(ising, cls) else cls(ising)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError('IsingProblem is immutable')
+
+    def __reduce__(self):
+        return IsingProblem.from_edges, (self.n_qubits, self.rows, self.cols, self.weights)
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __eq__(self, other: Any) -> bool:
+        return (
+            isinstance(other, IsingProblem) and self._hash == other._hash and self.n_qubits == other.n_qubits
+            and np.array_equal(self.rows, other.rows) and np.array_equal(self.cols, other.cols)
+            and np.array_equal(self.weights, other.weights)
+        )
+
+    def __repr__(self) -> str:
+        return f'IsingProblem(n_qubits={self.n_qubits}, edges={len(self.weights)})'
+
+    @property
+    def edges(self) -> List[Tuple[int, int, float]]:
+        """Merged edges as (i, j, weight), i < j.
+        """
+        return list(zip(self.rows.tolist(), self.cols.tolist(), self.weights.tolist()))
+
+    @property
+    def coupling(self) -> np.ndarray:
+        """Symmetric dense matrix J + J^T with a zero diagonal, read-only.
+        """
+        if self._coupling is None:
+            coupling = np.zeros((self.n_qubits, self.n_qubits))
+            coupling[self.rows, self.cols] = self.weights
+            coupling += coupling.T
+            coupling.flags.writeable = False
+            super().__setattr__('_coupling', coupling)
+        return self._coupling
+
+    @property
+    def energies(self) -> np.ndarray:
+        """Energy of every computational basis state, qubit 0 being the most significant bit of
+        the basis state index as in Braket bitstrings. Read-only vector of 2^n energies.
+        """
+        if self._energies is None:
+            shifts = self.n_qubits - 1 - np.arange(self.n_qubits)
+            indices = np.arange(2**self.n_qubits)
+            energies = np.zeros(2**self.n_qubits)
+            for i, j, weight in zip(self.rows, self.cols, self.weights):
+                # s_i s_j = +1 when the two bits are equal, -1 otherwise
+                energies += weight * (1 - 2 * (((indices >> shifts[i]) ^ (indices >> shifts[j])) & 1))
+            energies.flags.writeable = False
+            super().__setattr__('_energies', energies)
+        return self._energies
+
+    def spin_energies(self, spins: np.ndarray) -> np.ndarray:
+        """Energies of spin assignments in one vectorized pass.
+        Args:
+            spins (ndarray): Matrix of assignments x qubits with values +1 and -1
+        Returns:
+            ndarray: Energy of every assignment
+        """
+        spins = np.asarray(spins, dtype=float)
+        return (spins[:, self.rows] * spins[:, self.cols]) @ self.weights
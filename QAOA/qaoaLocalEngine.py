@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# zato: ide-deploy=True
+import numpy as np
+
+from qaoaIsing import IsingProblem
+
+# ##############################################################################
+
+def ising_energies(ising: np.ndarray) -> np.ndarray:
+    """Energy of every computational basis state under the cost Hamiltonian of the QAOA template,
+    sum of ising[i, j] * Z_i Z_j over the non-zero entries of the matrix.
+
+    Qubit 0 is the most significant bit of the basis state index, as in Braket bitstrings.
+
+    Args:
+        ising (ndarray): Ising interaction matrix or IsingProblem, which keeps the vector
+
+    Returns:
+        ndarray: Read-only vector of 2^n energies
+    """
+    return IsingProblem.coerce(ising).energies
+
+
+def qaoa_statevector(energies: np.ndarray, n_qubits: int, values: np.ndarray) -> np.ndarray:
+    """Statevector prepared by the QAOA template, computed exactly with NumPy.
+
+    The cost layer is diagonal, exp(-i gamma E(z) / 2) as decomposed_zz_gate applies
+    rz(gamma * J_ij) to every edge, and the driver layer applies rx(2 * beta) to every qubit.
+
+    Args:
+        energies (ndarray): Energies of the basis states, see ising_energies
+        n_qubits (int): Number of qubits
+        values (ndarray): gamma_0 ... gamma_{p - 1}, beta_0 ... beta_{p - 1}
+
+    Returns:
+        ndarray: Statevector of 2^n amplitudes
+    """
+    n_layers = len(values) // 2
+    state = np.full(2**n_qubits, 2 ** (-n_qubits / 2), dtype=complex)
+    for gamma, beta in zip(values[:n_layers], values[n_layers:]):
+        state *= np.exp(-0.5j * gamma * energies)
+        cos, sin = np.cos(beta), -1j * np.sin(beta)
+        for qubit in range(n_qubits):
+            # Axis 1 is the qubit, flipping it swaps the two halves
+            view = state.reshape(2**qubit, 2, -1)
+            state = (cos * view + sin * view[:, ::-1, :]).reshape(-1)
+    return state
+
+
+def qaoa_expectation(energies: np.ndarray, n_qubits: int, values: np.ndarray) -> float:
+    """Expectation value of the cost Hamiltonian, the cost computed by qaoa.qaoa-cost-function.
+
+    Args:
+        energies (ndarray): Energies of the basis states, see ising_energies
+        n_qubits (int): Number of qubits
+        values (ndarray): gamma_0 ... gamma_{p - 1}, beta_0 ... beta_{p - 1}
+
+    Returns:
+        float: Expectation value
+    """
+    state = qaoa_statevector(energies, n_qubits, values)
+    return float(np.dot(state.real**2 + state.imag**2, energies))
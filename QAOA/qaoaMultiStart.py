@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# zato: ide-deploy=True
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from qaoaIsing import IsingProblem
+from qaoaLocalEngine import qaoa_expectation
+from qaoaOptimizer import OptimizerController
+from qaoaQrngInput import Output
+
+from zato.server.service import Service
+
+def optimize_start(
+    problem: IsingProblem,
+    n_layers: int,
+    x0: np.ndarray,
+    optimizer: str,
+    max_evaluations: Optional[int],
+    seed: Optional[int] = None,
+) -> Dict:
+    """One start, or one phase of a start, of a multi-start optimization, run on the local engine
+    in a worker process.
+
+    Args:
+        problem (IsingProblem): Cost Hamiltonian
+        n_layers (int): Number of layers
+        x0 (ndarray): Initial parameters
+        optimizer (str): Optimizer, a key of qaoaOptimizer.OPTIMIZERS
+        max_evaluations (int): Cost evaluations of the start, None for no limit
+        seed (int): Seed of stochastic optimizers. Default is None
+
+    Returns:
+        Dict: Initial and best parameters, best cost, evaluations and stop reason
+    """
+    n_qubits = problem.n_qubits
+    energies = problem.energies
+
+    controller = OptimizerController(optimizer=optimizer, max_evaluations=max_evaluations, seed=seed)
+    result = controller.minimize(lambda values: qaoa_expectation(energies, n_qubits, values), x0)
+    return {
+        "x0": np.asarray(x0).tolist(),
+        "params": result.x.tolist(),
+        "cost": result.fun,
+        "evaluations": result.evaluations,
+        "reason": result.reason,
+    }
+
+
+def multi_start(
+    ising: np.ndarray,
+    n_layers: int,
+    starts: int = 8,
+    max_workers: Optional[int] = None,
+    optimizer: str = 'Nelder-Mead',
+    max_evaluations: Optional[int] = 150,
+    prune_after: Optional[int] = 30,
+    prune_margin: float = 0.1,
+    seed: Optional[int] = None,
+) -> Tuple[Dict, List[Dict]]:
+    """Independent optimizations of the QAOA parameters from random starts, run in parallel
+    worker processes against the local engine.
+
+    Pruning is a barrier: every start first runs prune_after evaluations, the starts whose best
+    cost is worse than the best of all starts by more than prune_margin (relative) are pruned,
+    and the others continue from their best parameters with the rest of max_evaluations. Which
+    starts are pruned depends on the seed only, not on the worker count or completion order.
+
+    Args:
+        ising (ndarray): Ising interaction matrix or IsingProblem
+        n_layers (int): Number of layers
+        starts (int): Number of starts. Default is 8
+        max_workers (int): Worker processes. Default is None, one per start up to the CPU count
+        optimizer (str): Optimizer, a key of qaoaOptimizer.OPTIMIZERS. Default is 'Nelder-Mead'
+        max_evaluations (int): Cost evaluations of every start, None for no limit. Default is 150
+        prune_after (int): Evaluations before the starts are pruned, None disables pruning. Default is 30
+        prune_margin (float): Allowed relative gap to the best cost. Default is 0.1
+        seed (int): Seed of the starts. Default is None
+
+    Returns:
+        Tuple[Dict, List[Dict]]: Best start and the summary of every start, see optimize_start
+    """
+    # Pickled to the workers as its edges, every worker computes the energies once
+    problem = IsingProblem.coerce(ising)
+    rng = np.random.default_rng(seed)
+    initial_values = rng.uniform(0, np.pi, size=(starts, 2 * n_layers))
+    seeds = [int(start_seed) for start_seed in rng.integers(2**32, size=starts)]
+    max_workers = max_workers or min(starts, os.cpu_count() or 1)
+    pruning = prune_after is not None and (max_evaluations is None or prune_after < max_evaluations)
+
+    # Spawned workers do not inherit the state of the server process
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers, mp_context=context) as executor:
+        budget = prune_after if pruning else max_evaluations
+        futures = [
+            executor.submit(optimize_start, problem, n_layers, x0, optimizer, budget, start_seed)
+            for x0, start_seed in zip(initial_values, seeds)
+        ]
+        summaries = [future.result() for future in futures]
+
+        if pruning:
+            best = min(summary["cost"] for summary in summaries)
+            remaining = None if max_evaluations is None else max_evaluations - prune_after
+            continued = {}
+            for start, summary in enumerate(summaries):
+                if summary["cost"] - best > prune_margin * max(1.0, abs(best)):
+                    summary["reason"] = 'pruned'
+                elif summary["reason"] == 'max_evaluations':
+                    continued[start] = executor.submit(optimize_start, problem, n_layers, summary["params"],
+                                                       optimizer, remaining, seeds[start])
+
+            for start, future in continued.items():
+                summary, resumed = summaries[start], future.result()
+                summary["evaluations"] += resumed["evaluations"]
+                summary["reason"] = resumed["reason"]
+                if resumed["cost"] < summary["cost"]:
+                    summary["params"], summary["cost"] = resumed["params"], resumed["cost"]
+
+    for start, summary in enumerate(summaries):
+        summary["start"] = start
+    return min(summaries, key=lambda summary: summary["cost"]), summaries
+
+
+class QaoaMultiStart(Service):
+    """ Optimizes the QAOA parameters from several random starts in parallel on the local engine
+    and returns the best parameters with the summary of every start.
+    """
+    name = 'qaoa.qaoa-multi-start'
+
+    input = Output
+    starts = 8
+    # None uses one worker process per start up to the CPU count
+    max_workers = None
+    optimizer = 'Nelder-Mead'
+    max_evaluations = 150
+    prune_after = 30
+    prune_margin = 0.1
+
+    def handle(self):
+        input = self.request.input
+        best, summaries = multi_start(
+            IsingProblem.coerce(input.matrix),
+            input.n_layers,
+            starts=self.starts,
+            max_workers=self.max_workers,
+            optimizer=self.optimizer,
+            max_evaluations=self.max_evaluations,
+            prune_after=self.prune_after,
+            prune_margin=self.prune_margin,
+        )
+        self.logger.info(
+            'QAOA multi-start: best cost %s from start %d, %d of %d starts pruned', best["cost"], best["start"],
+            sum(summary["reason"] == 'pruned' for summary in summaries), len(summaries)
+        )
+        self.response.payload = {"params": best["params"], "cost": best["cost"], "starts": summaries}
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+# zato: ide-deploy=True
+import itertools
+import math
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Option of each SciPy method bounding its number of cost evaluations
+SCIPY_EVALUATION_OPTION = {
+    'Nelder-Mead': 'maxfev',
+    'COBYLA': 'maxiter',
+    'L-BFGS-B': 'maxfun',
+}
+# Iterations the stability constant of SPSA is computed for when the evaluations are not limited
+SPSA_ITERATIONS = 100
+
+
+@dataclass
+class OptimizationResult:
+    x: np.ndarray
+    fun: float
+    evaluations: int
+    tasks: int
+    shots: int
+    elapsed: float
+    # 'converged', 'max_evaluations', 'plateau', 'max_seconds', 'max_tasks', 'max_shots' or 'cancelled'
+    reason: str
+
+
+class _Stop(Exception):
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def scipy_optimizer(method: str) -> Callable:
+    """Optimizer running scipy.optimize.minimize with the given method.
+    Args:
+        method (str): SciPy method, a key of SCIPY_EVALUATION_OPTION
+    Returns:
+        Callable: Optimizer with the signature of spsa
+    """
+    def optimize(fun, x0, max_evaluations, bounds=None, seed=None):
+        from scipy.optimize import minimize
+
+        # Without a limit SciPy applies the default of the method
+        options = {SCIPY_EVALUATION_OPTION[method]: max_evaluations} if max_evaluations is not None else {}
+        minimize(fun, x0, method=method, bounds=bounds, options=options)
+
+    return optimize
+
+
+def spsa(
+    fun: Callable[[np.ndarray], float],
+    x0: np.ndarray,
+    max_evaluations: Optional[int],
+    bounds: Optional[Sequence[Tuple[float, float]]] = None,
+    seed: Optional[int] = None,
+    a: float = 0.2,
+    c: float = 0.1,
+    alpha: float = 0.602,
+    gamma: float = 0.101,
+) -> None:
+    """Simultaneous Perturbation Stochastic Approximation. Estimates the gradient with two
+    evaluations per iteration whatever the number of parameters, which keeps the device task
+    count low and tolerates shot noise.
+
+    Args:
+        fun (Callable[[ndarray], float]): Cost function
+        x0 (ndarray): Initial parameters
+        max_evaluations (Optional[int]): Number of cost evaluations, None to iterate until the cost
+            function raises
+        bounds (Sequence[Tuple[float, float]]): Bounds the parameters are clipped to. Default is None
+        seed (int): Seed of the perturbations. Default is None
+        a (float): Step size gain. Default is 0.2
+        c (float): Perturbation gain. Default is 0.1
+        alpha (float): Step size decay exponent. Default is 0.602
+        gamma (float): Perturbation decay exponent. Default is 0.101
+    """
+    rng = np.random.default_rng(seed)
+    x = np.array(x0, dtype=float)
+    lower, upper = (np.array(b, dtype=float) for b in zip(*bounds)) if bounds else (None, None)
+    iterations = max_evaluations // 2 if max_evaluations is not None else None
+    # Stability constant of Spall's gain sequence, 10% of the iterations
+    A = 0.1 * (iterations if iterations is not None else SPSA_ITERATIONS)
+
+    for k in itertools.count() if iterations is None else range(iterations):
+        a_k = a / (k + 1 + A) ** alpha
+        c_k = c / (k + 1) ** gamma
+        delta = rng.choice([-1.0, 1.0], size=x.shape)
+        gradient = (fun(x + c_k * delta) - fun(x - c_k * delta)) / (2 * c_k) * delta
+        x = x - a_k * gradient
+        if bounds:
+            x = np.clip(x, lower, upper)
+
+
+# Optimizers by name, new ones are registered here
+OPTIMIZERS = {
+    'Nelder-Mead': scipy_optimizer('Nelder-Mead'),
+    'COBYLA': scipy_optimizer('COBYLA'),
+    'L-BFGS-B': scipy_optimizer('L-BFGS-B'),
+    'SPSA': spsa,
+}
+
+
+class OptimizerController:
+    """ Runs an optimizer within an evaluation, wall-clock, device task and shot budget, and
+    stops it early when the best cost reaches a plateau or should_stop returns true.
+
+    The best parameters seen are returned whatever ended the optimization. None disables a
+    limit, and SPSA, which has no convergence criterion of its own, needs at least one.
+    """
+    def __init__(
+        self,
+        optimizer: str = 'Nelder-Mead',
+        max_evaluations: Optional[int] = 150,
+        max_seconds: Optional[float] = None,
+        max_tasks: Optional[int] = None,
+        max_shots: Optional[int] = None,
+        plateau_window: Optional[int] = 20,
+        plateau_tolerance: float = 1e-6,
+        should_stop: Optional[Callable[[], bool]] = None,
+        bounds: Optional[Sequence[Tuple[float, float]]] = None,
+        seed: Optional[int] = None,
+    ):
+        if optimizer not in OPTIMIZERS:
+            raise ValueError(f'Unknown optimizer {optimizer}, expected one of {sorted(OPTIMIZERS)}')
+        limits = (max_evaluations, max_seconds, max_tasks, max_shots, should_stop)
+        if optimizer == 'SPSA' and not plateau_window and all(limit is None for limit in limits):
+            raise ValueError('SPSA needs at least one limit, it would never stop')
+        self.optimizer = optimizer
+        self.max_evaluations = max_evaluations
+        self.max_seconds = max_seconds
+        self.max_tasks = max_tasks
+        self.max_shots = max_shots
+        self.plateau_window = plateau_window
+        self.plateau_tolerance = plateau_tolerance
+        self.should_stop = should_stop
+        self.bounds = bounds
+        self.seed = seed
+
+    def _check_budget(self, evaluations: int, tasks: int, shots: int, started_at: float, run_shots: int) -> None:
+        if self.should_stop is not None and self.should_stop():
+            raise _Stop('cancelled')
+        if self.max_evaluations is not None and evaluations >= self.max_evaluations:
+            raise _Stop('max_evaluations')
+        if self.max_seconds is not None and time.monotonic() - started_at >= self.max_seconds:
+            raise _Stop('max_seconds')
+        if self.max_tasks is not None and tasks + 1 > self.max_tasks:
+            raise _Stop('max_tasks')
+        if self.max_shots is not None and run_shots and shots + run_shots > self.max_shots:
+            raise _Stop('max_shots')
+
+    def _plateau(self, best_history: List[float]) -> bool:
+        if not self.plateau_window or len(best_history) <= self.plateau_window:
+            return False
+        improvement = best_history[-self.plateau_window - 1] - best_history[-1]
+        return improvement <= self.plateau_tolerance * max(1.0, abs(best_history[-1]))
+
+    def minimize(self, cost: Callable[[np.ndarray], float], x0: np.ndarray, shots: int = 0) -> OptimizationResult:
+        """Minimize a cost function of which every evaluation runs one device task.
+        Args:
+            cost (Callable[[ndarray], float]): Cost function
+            x0 (ndarray): Initial parameters
+            shots (int): Shots of every evaluation, 0 for exact expectation values. Default is 0
+        Returns:
+            OptimizationResult: Best parameters and cost, spent budget and the stop reason
+        """
+        started_at = time.monotonic()
+        state = {'evaluations': 0, 'tasks': 0, 'shots': 0, 'x': np.array(x0, dtype=float), 'fun': math.inf}
+        best_history = []
+
+        def budgeted_cost(values: np.ndarray) -> float:
+            self._check_budget(state['evaluations'], state['tasks'], state['shots'], started_at, shots)
+            value = float(cost(values))
+            state['evaluations'] += 1
+            state['tasks'] += 1
+            state['shots'] += shots
+            if value < state['fun']:
+                state['x'], state['fun'] = np.array(values, dtype=float), value
+            best_history.append(state['fun'])
+            if self._plateau(best_history):
+                raise _Stop('plateau')
+            return value
+
+        try:
+            OPTIMIZERS[self.optimizer](
+                budgeted_cost, np.array(x0, dtype=float), self.max_evaluations, bounds=self.bounds, seed=self.seed
+            )
+            reached = self.max_evaluations is not None and state['evaluations'] >= self.max_evaluations
+            reason = 'max_evaluations' if reached else 'converged'
+        except _Stop as e:
+            reason = e.reason
+
+        return OptimizationResult(
+            state['x'], state['fun'], state['evaluations'], state['tasks'], state['shots'],
+            time.monotonic() - started_at, reason,
+        )
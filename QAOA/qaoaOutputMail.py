@@ -1,12 +1,7 @@
 # -*- coding: utf-8 -*-
 # zato: ide-deploy=True
-import json
-import matplotlib.pyplot as plt
-
-import numpy as np
-
 from zato.common import SMTPMessage
-from zato.server.service import Service, Model
+from zato.server.service import Service
 
 class QaoaOutputMail(Service):
 
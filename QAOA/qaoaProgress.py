@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+# zato: ide-deploy=True
+import json
+import time
+from collections import OrderedDict, deque
+from dataclasses import asdict, dataclass
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Sequence
+
+from zato.server.service import Service
+
+# Events kept per optimization, older ones are dropped
+BUFFER_SIZE = 1000
+# Optimizations whose progress is kept, the least recently started ones are dropped
+MAX_JOBS = 64
+
+
+@dataclass
+class ProgressEvent:
+    job: str
+    iteration: int
+    params: List[float]
+    cost: float
+    elapsed: float
+
+
+class ProgressChannel:
+    """ Progress of one optimization: a bounded ring buffer of ProgressEvent and the services
+    notified of every event.
+    """
+    def __init__(
+        self,
+        job: str,
+        maxsize: int = BUFFER_SIZE,
+        subscribers: Sequence[str] = (),
+        notify: Optional[Callable[[str, str], None]] = None,
+    ):
+        self.job = job
+        self.subscribers = list(subscribers)
+        self.notify = notify
+        self.started_at = time.time()
+        self.iterations = 0
+        self.best = None
+        self.cancelled = False
+        self.finished = False
+        self._events = deque(maxlen=maxsize)
+        self._lock = Lock()
+
+    def publish(self, params: Sequence[float], cost: float) -> ProgressEvent:
+        """Record the cost of an evaluation and notify the subscribers.
+        Args:
+            params (Sequence[float]): Parameters of the evaluation
+            cost (float): Cost of the evaluation
+        Returns:
+            ProgressEvent: Published event
+        """
+        with self._lock:
+            self.iterations += 1
+            event = ProgressEvent(
+                self.job, self.iterations, [float(p) for p in params], float(cost), time.time() - self.started_at
+            )
+            self._events.append(event)
+            if self.best is None or event.cost < self.best.cost:
+                self.best = event
+
+        if self.notify:
+            message = json.dumps(asdict(event))
+            for subscriber in self.subscribers:
+                self.notify(subscriber, message)
+        return event
+
+    def events(self, since: int = 0) -> List[ProgressEvent]:
+        """Buffered events after the given iteration.
+        Args:
+            since (int): Last iteration already seen by the caller. Default is 0
+        Returns:
+            List[ProgressEvent]: Events still in the buffer, oldest first
+        """
+        with self._lock:
+            return [event for event in self._events if event.iteration > since]
+
+    def costs(self) -> List[float]:
+        with self._lock:
+            return [event.cost for event in self._events]
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+    def summary(self) -> Dict:
+        with self._lock:
+            latest = self._events[-1] if self._events else None
+        return {
+            "job": self.job,
+            "iterations": self.iterations,
+            "elapsed": time.time() - self.started_at,
+            "latest": asdict(latest) if latest else None,
+            "best": asdict(self.best) if self.best else None,
+            "cancelled": self.cancelled,
+            "finished": self.finished,
+        }
+
+
+class ProgressRegistry:
+    """ Progress channels of the optimizations running in this server process, by job.
+    """
+    def __init__(self, max_jobs: int = MAX_JOBS):
+        self.max_jobs = max_jobs
+        self._channels = OrderedDict()
+        self._lock = Lock()
+
+    def open(self, job: str, **kwargs) -> ProgressChannel:
+        channel = ProgressChannel(job, **kwargs)
+        with self._lock:
+            self._channels[job] = channel
+            while len(self._channels) > self.max_jobs:
+                self._channels.popitem(last=False)
+        return channel
+
+    def get(self, job: str) -> Optional[ProgressChannel]:
+        with self._lock:
+            return self._channels.get(job)
+
+    def channels(self) -> List[ProgressChannel]:
+        with self._lock:
+            return list(self._channels.values())
+
+
+progress = ProgressRegistry()
+
+
+class QaoaProgress(Service):
+    """ Progress of the QAOA optimizations.
+
+    With no 'job' in the payload returns the summary of every optimization. With a 'job'
+    returns its summary and its buffered events after iteration 'since', and cancels it
+    when 'cancel' is true.
+    """
+    name = 'qaoa.qaoa-progress'
+
+    def handle(self):
+        payload = self.request.payload or {}
+        if isinstance(payload, str):
+            payload = json.loads(payload)
+
+        job = payload.get('job')
+        if job is None:
+            self.response.payload = {"jobs": [channel.summary() for channel in progress.channels()]}
+            return
+
+        channel = progress.get(job)
+        if channel is None:
+            raise ValueError(f'Unknown QAOA optimization {job}')
+
+        if payload.get('cancel'):
+            channel.cancel()
+            self.logger.info('QAOA optimization %s cancelled at iteration %d', job, channel.iterations)
+
+        output = channel.summary()
+        output["events"] = [asdict(event) for event in channel.events(int(payload.get('since', 0)))]
+        self.response.payload = output
@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 # zato: ide-deploy=True
 from dataclasses import dataclass
-import struct
 
 import numpy as np
 
@@ -20,6 +20,9 @@ from braket.devices import Device, LocalSimulator
 from braket.tasks import QuantumTask
 from scipy.optimize import minimize
 
+# Cost evaluations between progress lines
+PROGRESS_EVERY = 10
+
 
 def cost_function(
     values: np.ndarray,
@@ -45,9 +48,10 @@ def cost_function(
     )
     task = device.run(fixed_circuit, shots=shots)
     exp_vals = task.result().result_types
-    print(dict(zip(np.array(list(circ.parameters), dtype=str), values)))
     cost = sum(c * s.value for c, s in zip(coeffs, exp_vals))
     cost_history.append(cost)
+    if len(cost_history) % PROGRESS_EVERY == 0:
+        print(f"iteration {len(cost_history)}: cost {cost:.6f}, best {min(cost_history):.6f}")
     return cost
 
 
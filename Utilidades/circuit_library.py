@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# zato: ide-deploy=True
+
+import math
+from functools import lru_cache
+from typing import Sequence
+
+from braket.circuits import Circuit
+
+# Maximum number of circuit templates kept in memory
+CACHE_SIZE = 64
+
+
+def qft_circuit(
+    qubits: Sequence[int],
+    inverse: bool = False,
+    swaps: bool = False,
+    approximation_degree: int = 0,
+) -> Circuit:
+    """Quantum Fourier Transform on the given qubits. The template of the width is built once
+    and relabelled onto the qubits, without recomputing any angle.
+
+    qubits[0] is transformed first: it receives the Hadamard and the controlled phases of every
+    later qubit, qubits[k + j] controlling a rotation of 2*pi / 2^(j + 1) on qubits[k].
+
+    Args:
+        qubits (Sequence[int]): Qubits on which to apply the Quantum Fourier Transform
+        inverse (bool): If true return the inverse of the transform. Default is False
+        swaps (bool): Whether to reverse the order of the qubits with SWAP gates. Default is False
+        approximation_degree (int): Number of the smallest rotation orders dropped
+            (approximate QFT). Default is 0, the exact QFT
+
+    Returns:
+        Circuit: Circuit object that implements the Quantum Fourier Transform or its inverse
+    """
+    template = qft_template(len(qubits), inverse, swaps, approximation_degree)
+    return Circuit().add_circuit(template, target=list(qubits))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def qft_template(
+    num_qubits: int,
+    inverse: bool = False,
+    swaps: bool = False,
+    approximation_degree: int = 0,
+) -> Circuit:
+    """Quantum Fourier Transform on qubits 0 ... num_qubits - 1, see qft_circuit. The returned
+    circuit is shared by every caller and must not be modified.
+
+    Args:
+        num_qubits (int): Number of qubits
+        inverse (bool): If true return the inverse of the transform. Default is False
+        swaps (bool): Whether to reverse the order of the qubits with SWAP gates. Default is False
+        approximation_degree (int): Number of the smallest rotation orders dropped. Default is 0
+
+    Returns:
+        Circuit: Circuit object that implements the Quantum Fourier Transform or its inverse
+    """
+    if inverse:
+        return qft_template(num_qubits, False, swaps, approximation_degree).adjoint()
+
+    qft = Circuit()
+    max_distance = num_qubits - 1 - approximation_degree
+
+    for k in range(num_qubits):
+        qft.h(k)
+        for j in range(1, min(num_qubits - k, max_distance + 1)):
+            qft.cphaseshift(k + j, k, 2 * math.pi / (2 ** (j + 1)))
+
+    if swaps:
+        for i in range(num_qubits // 2):
+            qft.swap(i, num_qubits - 1 - i)
+
+    return qft
+
+
+def approximation_degree_for(num_qubits: int, precision: float) -> int:
+    """Approximation degree dropping every controlled phase with an angle below precision.
+
+    Args:
+        num_qubits (int): Number of qubits of the transform
+        precision (float): Smallest rotation angle kept
+
+    Returns:
+        int: Approximation degree
+    """
+    return sum(1 for j in range(1, num_qubits) if 2 * math.pi / (2 ** (j + 1)) < precision)
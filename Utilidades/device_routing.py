@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# zato: ide-deploy=True
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from braket.circuits import Circuit
+
+LOCAL_SIMULATOR = 'LocalSimulator'
+# Managed simulators, the only devices whose circuits may be moved to the local simulator
+MANAGED_SIMULATOR_PREFIX = 'arn:aws:braket:::device/quantum-simulator/'
+
+# ##############################################################################
+
+class RoutingPolicy:
+    """ Sends small circuits aimed at a managed simulator to the in-process simulator and the rest
+    to the managed simulator. Circuits aimed at a QPU always run on the QPU.
+
+    The cost of a circuit is estimated as its statevector simulation work, gate count * 2^qubits.
+    """
+    def __init__(self, max_qubits: int = 12, max_cost: int = 2**22, local_device: str = LOCAL_SIMULATOR):
+        self.max_qubits = max_qubits
+        self.max_cost = max_cost
+        self.local_device = local_device
+
+    def estimated_cost(self, circuit: 'Circuit') -> int:
+        """Statevector simulation work of a circuit.
+        Args:
+            circuit (Circuit): Circuit to run
+        Returns:
+            int: gate count * 2^qubit count
+        """
+        return len(circuit.instructions) * 2**circuit.qubit_count
+
+    def select(self, circuit: 'Circuit', device: str) -> str:
+        """Device a circuit is run on.
+        Args:
+            circuit (Circuit): Circuit to run
+            device (str): Device configured on the service
+        Returns:
+            str: local_device for small circuits aimed at a managed simulator, device otherwise
+        """
+        if not device.startswith(MANAGED_SIMULATOR_PREFIX):
+            return device
+        if circuit.qubit_count <= self.max_qubits and self.estimated_cost(circuit) <= self.max_cost:
+            return self.local_device
+        return device
+
+
+class DeviceRoutingMixin:
+    """ Runs the circuit of an AWSQuantumService on the device chosen by routing_policy
+    instead of always using quantum_computer. Services override routing_policy with their
+    own limits, or set it to None to always use quantum_computer.
+    """
+    routing_policy = RoutingPolicy()
+
+    def handle(self):
+        if self.routing_policy is not None:
+            circuit = self.circuit()
+            # The service builds its circuit again in handle otherwise
+            self.circuit = lambda: circuit
+            self.quantum_computer = self.routing_policy.select(circuit, self.quantum_computer)
+            self.logger.info('Running %s on %s', self.name, self.quantum_computer)
+
+        return super().handle()
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+# zato: ide-deploy=True
+
+import queue
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+from threading import Lock, Thread
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+
+if TYPE_CHECKING:
+    from qiskit import QuantumCircuit
+
+# ##############################################################################
+
+class CircuitResult:
+    """ Result of a single circuit of a multi-circuit job, with the accessors
+    the IBM services use on a single-circuit qiskit Result.
+    """
+    def __init__(self, result: Any, index: int):
+        self.result = result
+        self.index = index
+
+    def get_counts(self) -> Dict[str, int]:
+        return self.result.get_counts(self.index)
+
+    def get_memory(self) -> List[str]:
+        return self.result.get_memory(self.index)
+
+
+# Runs a list of circuits as one job with the given shots and memory, returns the qiskit Result
+Executor = Callable[[List['QuantumCircuit'], int], Any]
+
+
+class _Request:
+
+    def __init__(self, circuit: 'QuantumCircuit', shots: int, execute: Optional[Executor]):
+        self.circuit = circuit
+        self.shots = shots
+        self.execute = execute
+        self.future = Future()
+
+
+class CircuitBatcher:
+    """ Coalesces the circuits submitted within max_wait seconds into a single
+    multi-circuit job of at most max_batch_size circuits and hands each caller
+    the result of its own circuit.
+
+    Jobs are run by execute, or by the executor of the first request of the job when a request
+    brings its own. A failed job fails the request of every circuit in it.
+    """
+    def __init__(self, execute: Optional[Executor] = None, max_batch_size: int = 20, max_wait: float = 0.05):
+        self.execute = execute
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._lock = Lock()
+        self._worker = None
+
+    def submit(self, circuit: 'QuantumCircuit', shots: int, execute: Optional[Executor] = None) -> Future:
+        """Queue a circuit for the next job.
+        Args:
+            circuit (QuantumCircuit): Circuit to run
+            shots (int): Number of shots
+            execute (Optional[Executor]): Executor of the job if the request leads it. Default is None
+        Returns:
+            Future: Resolves to the CircuitResult of the circuit
+        """
+        request = _Request(circuit, shots, execute)
+        self._queue.put(request)
+        self._ensure_worker()
+        return request.future
+
+    def run(
+        self, circuit: 'QuantumCircuit', shots: int, execute: Optional[Executor] = None, timeout: Optional[float] = None
+    ) -> CircuitResult:
+        """Queue a circuit and wait for its result.
+        Args:
+            circuit (QuantumCircuit): Circuit to run
+            shots (int): Number of shots
+            execute (Optional[Executor]): Executor of the job if the request leads it. Default is None
+            timeout (Optional[float]): Seconds to wait for the result
+        Returns:
+            CircuitResult: Result of the circuit
+        """
+        return self.submit(circuit, shots, execute).result(timeout)
+
+    def _ensure_worker(self) -> None:
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = Thread(target=self._run, name='ibm-circuit-batcher', daemon=True)
+                self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._execute(batch)
+
+    def _execute(self, batch: List[_Request]) -> None:
+        # A job has a single shot count, so requests are grouped by it
+        by_shots = defaultdict(list)
+        for request in batch:
+            by_shots[request.shots].append(request)
+
+        for shots, requests in by_shots.items():
+            execute = requests[0].execute or self.execute
+            try:
+                result = execute([request.circuit for request in requests], shots)
+            except Exception as e:
+                for request in requests:
+                    request.future.set_exception(e)
+                continue
+
+            for index, request in enumerate(requests):
+                request.future.set_result(CircuitResult(result, index))
+
+# ##############################################################################
+
+_batchers = {}
+_batchers_lock = Lock()
+
+
+def get_batcher(name: str, max_batch_size: int = 20, max_wait: float = 0.05) -> CircuitBatcher:
+    """Shared batcher of a service, created with the given limits on first use.
+    Args:
+        name (str): Name of the service, or of anything else the batcher is shared by
+        max_batch_size (int): Maximum number of circuits per job
+        max_wait (float): Maximum seconds a circuit waits for others to join its job
+    Returns:
+        CircuitBatcher: Batcher of the service, its requests bring the executor of their jobs
+    """
+    with _batchers_lock:
+        batcher = _batchers.get(name)
+        if batcher is None:
+            batcher = CircuitBatcher(None, max_batch_size, max_wait)
+            _batchers[name] = batcher
+        return batcher
+
+
+def local_backend() -> Any:
+    """Local Qiskit simulator, Aer when it is installed and BasicSimulator otherwise.
+    Only for tests and benchmarks, its output is pseudo-random.
+    """
+    try:
+        from qiskit_aer import AerSimulator
+    except ImportError:
+        from qiskit.providers.basic_provider import BasicSimulator
+        return BasicSimulator()
+    return AerSimulator()
+
+
+def backend_executor(backend: Any) -> Executor:
+    """Executor running the jobs on a Qiskit backend, e.g. local_backend().
+    """
+    return lambda circuits, shots: backend.run(circuits, shots=shots, memory=True).result()
+
+
+class BatchedExecutionMixin:
+    """ Runs the circuit of an IBMQuantumService through the shared CircuitBatcher
+    of the service instead of submitting one job per request.
+
+    The job of a batch is submitted through the execution path of the IBMQuantumService of its
+    first request, with its credentials and backend, as a multi-circuit job. use_local_backend
+    runs the jobs on local_backend instead, for tests.
+    """
+    max_batch_size = 20
+    max_wait = 0.05
+    use_local_backend = False
+
+    def execute_batch(self, circuits: List['QuantumCircuit'], shots: int) -> Any:
+        """Run circuits as one job through the execution path of the service.
+        Args:
+            circuits (List[QuantumCircuit]): Circuits of the job
+            shots (int): Number of shots
+        Returns:
+            Any: qiskit Result of the job
+        """
+        if self.use_local_backend:
+            return backend_executor(local_backend())(circuits, shots)
+
+        # The request of this instance waits on the batch meanwhile, so its hooks are swapped
+        # for the job and restored before it resumes
+        hooks = {name: self.__dict__.get(name) for name in ('circuit', 'get_runs', 'after_circuit_execution')}
+        job = {}
+        self.circuit = lambda: circuits
+        self.get_runs = lambda: shots
+        self.after_circuit_execution = lambda: job.update(result=self.circuit_result)
+        try:
+            super().handle()
+        finally:
+            for name, hook in hooks.items():
+                if hook is None:
+                    self.__dict__.pop(name, None)
+                else:
+                    setattr(self, name, hook)
+        return job['result']
+
+    def handle(self):
+        batcher = get_batcher(self.name, self.max_batch_size, self.max_wait)
+        self.circuit_result = batcher.run(self.circuit(), self.get_runs(), self.execute_batch)
+        self.after_circuit_execution()
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# zato: ide-deploy=True
+
+import hashlib
+import os
+import pickle
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import TYPE_CHECKING, Any, Optional
+
+if TYPE_CHECKING:
+    from braket.circuits import Circuit
+
+# ##############################################################################
+
+def circuit_key(circuit: 'Circuit', device: str, shots: int) -> str:
+    """Content address of a circuit run: hash of its OpenQASM program, the device and the shots.
+
+    Args:
+        circuit (Circuit): Circuit to run, including its result types
+        device (str): 'LocalSimulator' or the ARN of a Braket device
+        shots (int): Number of shots
+
+    Returns:
+        str: Hexadecimal SHA-256 digest
+    """
+    from braket.circuits.serialization import IRType
+
+    digest = hashlib.sha256()
+    digest.update(circuit.to_ir(IRType.OPENQASM).source.encode())
+    digest.update(f'\n{device}\n{shots}'.encode())
+    return digest.hexdigest()
+
+
+class MemoryBackend:
+    """ In-process LRU store with expiry.
+    """
+    def __init__(self, maxsize: int = 256, ttl: Optional[float] = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        expires_at = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class DiskBackend:
+    """ On-disk store, one pickle per key. Entries expire ttl seconds after being written and
+    the least recently read ones are removed beyond maxsize entries.
+    """
+    def __init__(self, directory: str, maxsize: int = 1024, ttl: Optional[float] = 24 * 3600):
+        self.directory = directory
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.pickle')
+
+    def get(self, key: str) -> Optional[Any]:
+        path = self._path(key)
+        try:
+            written_at = os.stat(path).st_mtime
+            if self.ttl is not None and written_at + self.ttl < time.time():
+                os.remove(path)
+                return None
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+        # The access time orders the eviction, the modification time the expiry
+        os.utime(path, (time.time(), written_at))
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        path = self._path(key)
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+        self._evict()
+
+    def _evict(self) -> None:
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.directory):
+                if name.endswith('.pickle'):
+                    path = os.path.join(self.directory, name)
+                    try:
+                        entries.append((os.stat(path).st_atime, path))
+                    except OSError:
+                        continue
+            entries.sort()
+            for _, path in entries[:max(0, len(entries) - self.maxsize)]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def clear(self) -> None:
+        for name in os.listdir(self.directory):
+            if name.endswith('.pickle'):
+                os.remove(os.path.join(self.directory, name))
+
+
+class ResultCache:
+    """ Task results of circuit runs, addressed by circuit_key.
+    """
+    def __init__(self, backend: Any = None):
+        self.backend = backend if backend is not None else MemoryBackend()
+
+    def get(self, circuit: 'Circuit', device: str, shots: int) -> Optional[Any]:
+        return self.backend.get(circuit_key(circuit, device, shots))
+
+    def set(self, circuit: 'Circuit', device: str, shots: int, result: Any) -> None:
+        self.backend.set(circuit_key(circuit, device, shots), result)
+
+# ##############################################################################
+
+class ResultCacheMixin:
+    """ Serves the task result of an AWSQuantumService from result_cache when the same circuit
+    already ran on the same device with the same shots.
+
+    Caching is opt-in: result_cache is None unless the service sets it. Sampled runs (shots > 0)
+    are only cached when cache_sampled_results is set, and a request can always bypass the cache
+    with 'no_cache': True in its payload.
+    """
+    result_cache = None
+    cache_sampled_results = False
+    # Set when circuit_result was served from result_cache
+    result_cache_hit = False
+
+    def handle(self):
+        if self.result_cache is None:
+            return super().handle()
+
+        circuit = self.circuit()
+        # The service builds its circuit again in handle otherwise
+        self.circuit = lambda: circuit
+
+        shots = self.get_runs()
+        payload = self.request.payload
+        if (shots and not self.cache_sampled_results) or (isinstance(payload, dict) and payload.get('no_cache')):
+            return super().handle()
+
+        result = self.result_cache.get(circuit, self.quantum_computer, shots)
+        if result is not None:
+            self.circuit_result = result
+            self.result_cache_hit = True
+            self.after_circuit_execution()
+            return
+
+        super().handle()
+        self.result_cache.set(circuit, self.quantum_computer, shots, self.circuit_result)
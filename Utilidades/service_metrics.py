@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+# zato: ide-deploy=True
+
+import os
+import time
+from bisect import bisect_left
+from datetime import datetime
+from threading import Lock
+from typing import Any, Dict, Optional, Tuple
+
+# Zato
+from zato.server.service import Service
+
+# Upper bounds in seconds of the histogram buckets, the last bucket is +Inf
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+# ##############################################################################
+
+class Histogram:
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """ Histograms and counters labelled by service, exportable in Prometheus text format.
+    """
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._lock = Lock()
+
+    def observe(self, name: str, labels: Dict[str, str], value: float) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def increment(self, name: str, labels: Dict[str, str], amount: float = 1) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def to_prometheus(self) -> str:
+        """Prometheus text exposition of every metric.
+        """
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.append(f'# TYPE {name} histogram')
+                for (metric, labels), histogram in sorted(self._histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(tuple(histogram.buckets) + (float('inf'),), histogram.counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append(f'{name}_bucket{_labels(labels, le=le)} {cumulative}')
+                    lines.append(f'{name}_sum{_labels(labels)} {histogram.sum}')
+                    lines.append(f'{name}_count{_labels(labels)} {histogram.count}')
+
+            for name in sorted({name for name, _ in self._counters}):
+                lines.append(f'# TYPE {name} counter')
+                for (metric, labels), value in sorted(self._counters.items()):
+                    if metric == name:
+                        lines.append(f'{name}{_labels(labels)} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path: str) -> None:
+        """Write the Prometheus text exposition to a file, e.g. for the node exporter textfile collector.
+        """
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(temporary, path)
+
+
+def _labels(labels: Tuple[Tuple[str, str], ...], **extra: str) -> str:
+    items = list(labels) + list(extra.items())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in items) + '}'
+
+
+metrics = MetricsRegistry()
+
+# ##############################################################################
+
+def _timestamp(value: Any) -> Optional[float]:
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.timestamp()
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+def remote_stages(result: Any, built_at: float, fetched_at: float) -> Dict[str, float]:
+    """Split the time between the end of the circuit construction and the start of the
+    post-processing into stages, as far as the task result metadata allows.
+
+    Braket results carry the task creation and end times and, on managed simulators, the
+    execution duration. Qiskit results carry the execution duration only. Without metadata
+    (e.g. in-process simulators) the whole span is reported as 'execute'.
+
+    Args:
+        result (Any): Braket or Qiskit task result
+        built_at (float): Epoch time the circuit was built
+        fetched_at (float): Epoch time the result was handed to the service
+
+    Returns:
+        Dict[str, float]: Seconds spent in each stage
+    """
+    span = fetched_at - built_at
+    task_metadata = getattr(result, 'task_metadata', None)
+    created_at = _timestamp(getattr(task_metadata, 'createdAt', None))
+    ended_at = _timestamp(getattr(task_metadata, 'endedAt', None))
+
+    # Results served from a cache or with skewed clocks are not split
+    if created_at is not None and ended_at is not None and built_at <= created_at <= ended_at <= fetched_at:
+        simulator_metadata = getattr(getattr(result, 'additional_metadata', None), 'simulatorMetadata', None)
+        duration = getattr(simulator_metadata, 'executionDuration', None)
+        execute = duration / 1000 if duration is not None else ended_at - created_at
+        stages = {
+            'submit': created_at - built_at,
+            'execute': execute,
+            'fetch': fetched_at - ended_at,
+        }
+        if duration is not None:
+            stages['queue'] = max(0.0, ended_at - created_at - execute)
+        return stages
+
+    time_taken = getattr(result, 'time_taken', None)
+    if time_taken is not None and time_taken <= span:
+        return {'execute': time_taken, 'queue': span - time_taken}
+
+    return {'execute': span}
+
+
+class TimedServiceMixin:
+    """ Records per-stage latency histograms and shot and task counters of a quantum service
+    (a service with circuit() and after_circuit_execution()) in the shared metrics registry.
+
+    The stages are build, submit, queue, execute, fetch (see remote_stages), post_process and
+    total. Results served by ResultCacheMixin run no task: their lookup is the cache stage and they
+    count in quantum_service_cache_hits_total instead of the task and shot counters. The mixin
+    goes first in the bases so that it sees every other mixin of the service.
+    """
+    def before_handle(self):
+        before_handle = getattr(super(), 'before_handle', None)
+        if before_handle:
+            before_handle()
+
+        started_at = time.time()
+        circuit = self.circuit
+        after_circuit_execution = self.after_circuit_execution
+        labels = {'service': self.name}
+        marks = {}
+
+        def timed_circuit():
+            start = time.time()
+            built = circuit()
+            marks['built_at'] = time.time()
+            metrics.observe('quantum_service_stage_seconds', dict(labels, stage='build'), marks['built_at'] - start)
+            return built
+
+        def timed_after_circuit_execution():
+            fetched_at = time.time()
+            device = {'device': str(self.quantum_computer)}
+            built_at = marks.get('built_at', started_at)
+            if getattr(self, 'result_cache_hit', False):
+                # No task ran, the result came from ResultCacheMixin
+                metrics.observe('quantum_service_stage_seconds', dict(labels, stage='cache'), fetched_at - built_at)
+                metrics.increment('quantum_service_cache_hits_total', dict(labels, **device))
+            else:
+                for stage, seconds in remote_stages(self.circuit_result, built_at, fetched_at).items():
+                    metrics.observe('quantum_service_stage_seconds', dict(labels, stage=stage), seconds)
+                metrics.increment('quantum_service_tasks_total', dict(labels, **device))
+                metrics.increment('quantum_service_shots_total', dict(labels, **device), self.get_runs())
+
+            after_circuit_execution()
+            finished_at = time.time()
+            metrics.observe('quantum_service_stage_seconds', dict(labels, stage='post_process'), finished_at - fetched_at)
+            metrics.observe('quantum_service_stage_seconds', dict(labels, stage='total'), finished_at - started_at)
+
+        # Instance attributes, so that every caller of circuit() and after_circuit_execution() is timed
+        self.circuit = timed_circuit
+        self.after_circuit_execution = timed_after_circuit_execution
+
+
+class QuantumMetrics(Service):
+    """ Returns the metrics of the quantum services in Prometheus text format and also writes
+    them to dump_path when the server sets it.
+    """
+    name = 'quantum.metrics'
+    # File the metrics are written to, e.g. for the node exporter textfile collector. Set on the
+    # server only, requests cannot choose it
+    dump_path = None
+
+    def handle(self):
+        if self.dump_path:
+            metrics.dump(self.dump_path)
+        self.response.payload = metrics.to_prometheus()